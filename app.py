@@ -1,28 +1,31 @@
 # --- app.py ---
 import sys
 import os
+import re
 import platform
 import shutil
-import difflib
 import traceback
+from collections import deque
+from dataclasses import dataclass
 import ast  # For snippet parsing
 from pathlib import Path
 
 # --- PyQt6 Imports ---
 # (Keep all PyQt6 imports as they were)
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QTextEdit,
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
     QLineEdit, QFileDialog, QLabel, QMessageBox, QCheckBox, QTreeView,
     QProgressBar, QSplitter, QDialog, QPlainTextEdit, QStyle, QMenu,
     QSizePolicy, QHeaderView, QSpacerItem,
 )
 from PyQt6.QtGui import (
-    QFont, QIcon, QShortcut, QKeySequence, QFontDatabase, QAction,
+    QFont, QIcon, QShortcut, QKeySequence, QFontDatabase,
     QDesktopServices, QUndoStack, QUndoCommand, QFileSystemModel,
-    QTextDocument, QPalette, QColor,
+    QTextDocument, QPalette, QColor, QTextCharFormat, QTextCursor,
 )
 from PyQt6.QtCore import (
-    Qt, QTimer, QDir, QSortFilterProxyModel, QRegularExpression, QModelIndex,
+    Qt, QTimer, QDir, QRegularExpression, QModelIndex,
+    QThreadPool,
 )
 
 
@@ -35,17 +38,36 @@ from utils import (
     safe_read_file,
     safe_write_file,
     backup_and_redo,
-    get_central_backup_paths # --- ADDED IMPORT ---
+    get_central_backup_paths, # --- ADDED IMPORT ---
+    fast_copy,
+    probe_path,
+    read_file_head,
+    split_lines,
 )
-from formatter_utils import preprocess_and_format_with_black
-from ast_utils import find_ast_node
+import ast_cache
 from highlighters import PythonHighlighter, DiffHighlighter
 from widgets import (
     CodeEditor,
     DiffDialog,
+    TreeFilterProxyModel,
 )
-from threads import FileLoaderThread, ReplacementThread
-
+from threads import FileLoaderThread, ReplacementThread, FormatWorker, FileOpWorker
+from regex_backend import compile_find_pattern
+
+
+# --- Pending Snippet Patch ---
+@dataclass(slots=True)
+class PendingPatch:
+    """What 'Diff (Snippet)' prepared for 'Apply Snippet': the target file's lines and the definition's line range."""
+    file_path: Path
+    start_line: int # Index of the definition's first line
+    end_line: int # Index after its last line
+    snippet_lines: list[str]
+    target_name: str
+    target_type: str # "function" or "class"
+    original_lines: list[str] # The file's lines when previewed, reused by apply while file_stamp still matches
+    ends_with_newline: bool
+    file_stamp: tuple[Path, int, int] | None # App._preview_key of the file, taken before it was read
 
 # --- Main Application Window ---
 class App(QWidget):
@@ -57,32 +79,78 @@ class App(QWidget):
     Backups/Redo files stored centrally in user's home directory.
     """
 
+    _BAK_META_CACHE_MAX = 256  # Max files with cached backup metadata
+    # Classification of Scan & Run progress messages (see update_progress); error markers take precedence over tags
+    _PROGRESS_ERROR_RE = re.compile(r"\[(?:Error|Read Error|Replace Error|Write Error|Backup/Redo Error)\]|Permission denied|Invalid regex|Cannot decode|formatting failed")
+    _PROGRESS_TAG_RE = re.compile(r"\[(Updated(?: with Format Warning| with Replace Error)?|Format Warning|No change|Cancelled|Skipped)\]")
+    _PROGRESS_TAG_COLORS = {
+        "Updated": COLOR_SUCCESS, "Updated with Format Warning": COLOR_WARNING, "Updated with Replace Error": COLOR_WARNING,
+        "Format Warning": COLOR_WARNING, "No change": COLOR_INFO, "Cancelled": COLOR_WARNING, "Skipped": COLOR_WARNING,
+    }
+    # Find bar flags for each (case sensitive, backward) combination
+    _FIND_FLAGS = {
+        (False, False): QTextDocument.FindFlag(0),
+        (True, False): QTextDocument.FindFlag.FindCaseSensitively,
+        (False, True): QTextDocument.FindFlag.FindBackward,
+        (True, True): QTextDocument.FindFlag.FindCaseSensitively | QTextDocument.FindFlag.FindBackward,
+    }
+
     # __init__ and other methods (_load_custom_font, _set_app_icon, _init_ui, _init_hotkeys, handle_escape, select_folder, _hide_tree_columns, filter_file_tree)
     # remain IDENTICAL to the previous version (after Black integration)
     # up to the show_tree_context_menu method.
 
     def __init__(self, parent: QWidget | None = None):
         super().__init__(parent)
-        self.files = []  # Stores list of Path objects from scan
+        self.files: list[Path] = []  # Paths from the last scan; only iterated (handed to ReplacementThread), never searched
         self.current_folder_path: str | None = None
         self.highlighter_preview: PythonHighlighter | None = None
         self.highlighter_new_code: PythonHighlighter | None = None
-        self.code_font = self._load_custom_font()  # Load font early
+        # Start with the fallback font; the custom font file is loaded after the first paint
+        self.code_font = QFont(FALLBACK_FONT_FAMILY, DEFAULT_FONT_SIZE - 1)
 
         # File System Model setup
         self.fs_model = QFileSystemModel()
-        self.proxy_model = QSortFilterProxyModel()
-        self.proxy_model.setSourceModel(self.fs_model)
+        # Only attached (to the model and the view) while a filter needs it; see _set_tree_proxy_active
+        self.proxy_model = TreeFilterProxyModel()
+        self._proxy_active = False
         self.proxy_model.setFilterKeyColumn(0)  # Filter by filename
         self.proxy_model.setRecursiveFilteringEnabled(True)  # Allow filtering subdirs
         self.proxy_model.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
 
         # State variables
-        self._pending_patch_info: dict | None = None  # Stores info for snippet apply
+        self._pending_patch_info: PendingPatch | None = None  # Stores info for snippet apply
+        self._preview_loaded: tuple[Path, int, int] | None = None  # (path, mtime_ns, size) shown in the preview
         self.scan_thread: FileLoaderThread | None = None
         self.replace_thread: ReplacementThread | None = None
+        self._format_worker: FormatWorker | None = None # Editor formatting job on the global thread pool
+        self._file_op_worker: FileOpWorker | None = None # Undo/redo file copies on the global thread pool
+        self._close_pending = False # A close is waiting for the background threads to stop; see closeEvent
+        self._force_close = False # The user chose to quit without waiting for them
         self._find_match_palette_no_match = QPalette() # For find input indication
         self._find_match_palette_match = QPalette() # For find input indication
+        self._find_bar_highlighted = False # True while the find input shows a match/no-match palette
+        self._editor_palette: QPalette | None = None # Restored on the find input; see _reset_find_bar_palette
+        # Normalized "<home>/<backup dir>/" prefix, for labelling paths inside the central backup store
+        self._central_backup_root_prefix = os.path.normcase(str(Path.home() / CODE_HELPER_BACKUP_DIR_NAME)) + os.sep
+        # Backup metadata per file: (mtime, backup_path, redo_path, backup_exists, redo_exists, error)
+        self._bak_meta_cache: dict[Path, tuple[float, Path | None, Path | None, bool, bool, str | None]] = {}
+        self._pending_filter_text = ""  # Latest filter text, applied when the debounce fires
+        self._pending_preview_path: Path | None = None  # Last clicked file, loaded when the preview debounce fires
+        self._preview_load_timer = QTimer(self)
+        self._preview_load_timer.setSingleShot(True)
+        self._preview_load_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self._preview_load_timer.timeout.connect(self._load_pending_preview)
+        self._filter_debounce = QTimer(self)
+        self._filter_debounce.setSingleShot(True)
+        self._filter_debounce.setInterval(FILTER_DEBOUNCE_MS)
+        self._filter_debounce.timeout.connect(self._apply_filter)
+        self._log_queue: deque[tuple[str, str]] = deque() # (message, color) awaiting flush
+        self._log_formats: dict[str, QTextCharFormat] = {} # Char format per log color
+        self._icons: dict[QStyle.StandardPixmap | tuple[str, QStyle.StandardPixmap | None], QIcon] = {} # See _standard_icon/_theme_icon
+        self._log_flush_timer = QTimer(self)
+        self._log_flush_timer.setSingleShot(True)
+        self._log_flush_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self._log_flush_timer.timeout.connect(self._flush_log_queue)
 
         # ### Undo/Redo ### Sticking to file-based .bak/.redo
         # self.undo_stack = QUndoStack(self)
@@ -98,13 +166,14 @@ class App(QWidget):
 
         # Load and set application icon
         self._set_app_icon()
+        QTimer.singleShot(0, self._apply_custom_font)
 
         # Initialize find palettes
         self._find_match_palette_no_match.setColor(QPalette.ColorRole.Base, QColor(COLOR_ERROR).lighter(180))
         self._find_match_palette_match.setColor(QPalette.ColorRole.Base, QColor(COLOR_SUCCESS).lighter(180))
 
-    def _load_custom_font(self) -> QFont:
-        """Loads the custom font (JetBrains Mono) or falls back."""
+    def _load_custom_font(self) -> QFont | None:
+        """Loads the custom font (JetBrains Mono), or returns None to keep the fallback."""
         font_path_str = ""  # Initialize
         try:
             font_path_str = resource_path(FONT_FILENAME)
@@ -127,7 +196,14 @@ class App(QWidget):
             print(f"Error loading custom font '{font_path_str}': {e}")
 
         print(f"Falling back to font: {FALLBACK_FONT_FAMILY}")
-        return QFont(FALLBACK_FONT_FAMILY, DEFAULT_FONT_SIZE - 1)
+        return None
+
+    def _apply_custom_font(self):
+        """Deferred from __init__: swaps the editors to the custom font once it is loaded."""
+        custom_font = self._load_custom_font()
+        if custom_font is None: return
+        self.code_font = custom_font
+        self.preview_area.setCodeFont(custom_font); self.new_code_editor.setCodeFont(custom_font)
 
     def _set_app_icon(self):
         """Loads and sets the application window icon."""
@@ -143,6 +219,21 @@ class App(QWidget):
         except Exception as e:
             print(f"Error loading application icon '{icon_path_str}': {e}")
 
+    def _standard_icon(self, pixmap: QStyle.StandardPixmap) -> QIcon:
+        """Returns the style's standard icon, looked up once per pixmap."""
+        icon = self._icons.get(pixmap)
+        if icon is None: icon = self._icons[pixmap] = self.style().standardIcon(pixmap)
+        return icon
+
+    def _theme_icon(self, name: str, fallback: QStyle.StandardPixmap | None = None) -> QIcon:
+        """Returns the icon theme's icon (or the fallback standard icon), looked up once."""
+        key = (name, fallback)
+        icon = self._icons.get(key)
+        if icon is None:
+            icon = QIcon.fromTheme(name, self._standard_icon(fallback)) if fallback is not None else QIcon.fromTheme(name)
+            self._icons[key] = icon
+        return icon
+
     def _init_ui(self):
         """Creates and arranges all UI widgets."""
         main_layout = QVBoxLayout(self)
@@ -152,7 +243,7 @@ class App(QWidget):
         # --- Top Controls (Folder Selection) ---
         top_layout = QHBoxLayout()
         self.select_btn = QPushButton("Select Folder")
-        self.select_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_DirOpenIcon))
+        self.select_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_DirOpenIcon))
         self.select_btn.setToolTip("Select the root project folder (Ctrl+O)")
         self.select_btn.clicked.connect(self.select_folder)
         top_layout.addWidget(self.select_btn)
@@ -179,13 +270,13 @@ class App(QWidget):
         find_replace_layout.addWidget(self.regex_checkbox)
         find_replace_layout.addSpacing(15)
         self.scan_btn = QPushButton("Scan & Run")
-        self.scan_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaPlay))
+        self.scan_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_MediaPlay))
         self.scan_btn.setToolTip("Scan selected folder, apply find/replace (if any), and format with Black.")
         self.scan_btn.clicked.connect(self.scan_and_run)
         self.scan_btn.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Fixed)
         find_replace_layout.addWidget(self.scan_btn)
         self.cancel_btn = QPushButton("Cancel")
-        self.cancel_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_MediaStop))
+        self.cancel_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_MediaStop))
         self.cancel_btn.setToolTip("Cancel the current Scan or Run operation.")
         self.cancel_btn.clicked.connect(self.cancel_operation)
         self.cancel_btn.setEnabled(False)
@@ -212,7 +303,7 @@ class App(QWidget):
         self.fs_model.setNameFilterDisables(False)
         self.fs_model.setReadOnly(False)
         self.file_tree = QTreeView()
-        self.file_tree.setModel(self.proxy_model)
+        self.file_tree.setModel(self.fs_model)
         self.file_tree.setRootIsDecorated(True)
         self.file_tree.setToolTip("Click a Python file to view its content. Right-click for options.")
         self.file_tree.clicked.connect(self.on_tree_clicked)
@@ -220,8 +311,7 @@ class App(QWidget):
         self.file_tree.customContextMenuRequested.connect(self.show_tree_context_menu)
         self.file_tree.setHeaderHidden(True)
         self.file_tree.setAnimated(True)
-        self.file_tree.setSortingEnabled(True)
-        self.file_tree.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+        self.file_tree.setSortingEnabled(False)  # Enabled in select_folder once a root is set
         self.file_tree.setSelectionBehavior(QTreeView.SelectionBehavior.SelectRows)
         self.file_tree.setUniformRowHeights(True)
         left_panel_layout.addWidget(self.file_tree)
@@ -273,12 +363,12 @@ class App(QWidget):
         self.find_bar_case_checkbox.setToolTip("Match case exactly.")
         find_bar_layout.addWidget(self.find_bar_case_checkbox)
         self.find_bar_prev_btn = QPushButton("Previous")
-        self.find_bar_prev_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowUp))
+        self.find_bar_prev_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_ArrowUp))
         self.find_bar_prev_btn.setToolTip("Find previous occurrence (Shift+F3)")
         self.find_bar_prev_btn.clicked.connect(self.find_previous_in_editor)
         find_bar_layout.addWidget(self.find_bar_prev_btn)
         self.find_bar_next_btn = QPushButton("Next")
-        self.find_bar_next_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowDown))
+        self.find_bar_next_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_ArrowDown))
         self.find_bar_next_btn.setToolTip("Find next occurrence (F3)")
         self.find_bar_next_btn.clicked.connect(self.find_next_in_editor)
         find_bar_layout.addWidget(self.find_bar_next_btn)
@@ -288,44 +378,44 @@ class App(QWidget):
         new_code_controls = QHBoxLayout()
         new_code_controls.setSpacing(8)
         self.format_code_btn = QPushButton("Clean & Format")
-        self.format_code_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogDetailedView))
+        self.format_code_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_FileDialogDetailedView))
         self.format_code_btn.setToolTip("Clean and format the code currently in this editor using Black (Ctrl+Shift+F).")
         self.format_code_btn.clicked.connect(self.format_new_code)
         new_code_controls.addWidget(self.format_code_btn)
         self.preview_diff_btn = QPushButton("Diff (Full)")
-        self.preview_diff_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_DialogYesButton).fromTheme("view-difference", self.style().standardIcon(QStyle.StandardPixmap.SP_FileLinkIcon)))
+        self.preview_diff_btn.setIcon(self._theme_icon("view-difference", QStyle.StandardPixmap.SP_FileLinkIcon))
         self.preview_diff_btn.setToolTip("Preview changes between selected file and cleaned/formatted pasted code (Ctrl+Shift+D).")
         self.preview_diff_btn.clicked.connect(self.preview_diff)
         new_code_controls.addWidget(self.preview_diff_btn)
         self.preview_snippet_btn = QPushButton("Diff (Snippet)")
-        self.preview_snippet_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogDetailedView).fromTheme("view-split-side-by-side", self.style().standardIcon(QStyle.StandardPixmap.SP_FileLinkIcon)))
+        self.preview_snippet_btn.setIcon(self._theme_icon("view-split-side-by-side", QStyle.StandardPixmap.SP_FileLinkIcon))
         self.preview_snippet_btn.setToolTip("Preview replacing matching function/class in selected file with cleaned/formatted pasted snippet (Ctrl+Alt+D).")
         self.preview_snippet_btn.clicked.connect(self.preview_snippet_change)
         new_code_controls.addWidget(self.preview_snippet_btn)
         self.apply_snippet_btn = QPushButton("Apply Snippet")
-        self.apply_snippet_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_DialogApplyButton))
+        self.apply_snippet_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_DialogApplyButton))
         self.apply_snippet_btn.setToolTip("Apply the change from the last successful 'Diff (Snippet)' preview (Ctrl+Alt+Enter).")
         self.apply_snippet_btn.setEnabled(False)
         self.apply_snippet_btn.clicked.connect(self.apply_snippet_patch)
         new_code_controls.addWidget(self.apply_snippet_btn)
         self.apply_new_code_btn = QPushButton("Apply Full File")
-        self.apply_new_code_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_DialogSaveButton))
+        self.apply_new_code_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_DialogSaveButton))
         self.apply_new_code_btn.setToolTip("Overwrite selected file with the (cleaned/formatted) content of this editor (Ctrl+Enter).")
         self.apply_new_code_btn.clicked.connect(self.apply_new_code)
         new_code_controls.addWidget(self.apply_new_code_btn)
         new_code_controls.addStretch(1)
         self.undo_btn = QPushButton("Undo")
-        self.undo_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowBack))
+        self.undo_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_ArrowBack))
         self.undo_btn.setToolTip("Undo last change to selected file (restores from central .bak, creates central .redo) (Ctrl+Z).") # Updated tooltip
         self.undo_btn.clicked.connect(self.undo_change)
         new_code_controls.addWidget(self.undo_btn)
         self.redo_btn = QPushButton("Redo")
-        self.redo_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowForward))
+        self.redo_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_ArrowForward))
         self.redo_btn.setToolTip("Redo last undo for selected file (restores from central .redo, creates central .bak) (Ctrl+Y).") # Updated tooltip
         self.redo_btn.clicked.connect(self.redo_change)
         new_code_controls.addWidget(self.redo_btn)
         self.reset_btn = QPushButton("Reset UI")
-        self.reset_btn.setIcon(self.style().standardIcon(QStyle.StandardPixmap.SP_BrowserReload))
+        self.reset_btn.setIcon(self._standard_icon(QStyle.StandardPixmap.SP_BrowserReload))
         self.reset_btn.setToolTip("Clear inputs, editors, logs, selections, and cancel operations.")
         self.reset_btn.clicked.connect(self.reset_ui_state)
         new_code_controls.addWidget(self.reset_btn)
@@ -345,11 +435,12 @@ class App(QWidget):
         self.progress_bar.setValue(0)
         self.progress_bar.setToolTip("Progress of the Scan & Run operation.")
         bottom_layout.addWidget(self.progress_bar)
-        self.log_area = QTextEdit()
+        self.log_area = QPlainTextEdit()
         self.log_area.setReadOnly(True)
         self.log_area.setFixedHeight(LOG_AREA_HEIGHT)
         self.log_area.setToolTip("Operation logs, errors, and diff summaries.")
-        self.log_area.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        self.log_area.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
+        self.log_area.setMaximumBlockCount(LOG_MAX_BLOCKS)  # Oldest lines are dropped past this
         bottom_layout.addWidget(self.log_area)
         main_layout.addLayout(bottom_layout)
         self.setLayout(main_layout)
@@ -377,7 +468,7 @@ class App(QWidget):
         if focused_widget == self.find_bar_input:
             if self.find_bar_input.text():
                 self.find_bar_input.clear()
-                self.find_bar_input.setPalette(self.new_code_editor.palette())
+                self._reset_find_bar_palette()
             else:
                 self.new_code_editor.setFocus()
         elif isinstance(focused_widget, QLineEdit):
@@ -412,26 +503,107 @@ class App(QWidget):
                 display_name = "..." + display_name[-77:]
             self.folder_label.setText(display_name)
             self.folder_label.setToolTip(folder)
-            source_root_index = self.fs_model.setRootPath(folder)
-            if not source_root_index.isValid():
-                self.log_message(f"Error: Could not set root path in model: {folder}", COLOR_ERROR)
-                QMessageBox.critical(self, "Model Error", f"Failed to set the file system model root path to:\n{folder}")
-                return
-            proxy_root_index = self.proxy_model.mapFromSource(source_root_index)
-            if not proxy_root_index.isValid():
-                self.log_message(f"Error: Could not map root path to proxy model: {folder}", COLOR_ERROR)
-            self.file_tree.setRootIndex(proxy_root_index)
-            QTimer.singleShot(0, self._hide_tree_columns)
+            # Re-rooting, hiding columns and sorting all trigger layout work;
+            # suspend painting so the tree is laid out once at the end.
+            self.file_tree.setUpdatesEnabled(False)
+            try:
+                source_root_index = self.fs_model.setRootPath(folder)
+                self.proxy_model.setRootPath(self.fs_model.filePath(source_root_index))
+                if not source_root_index.isValid():
+                    self.log_message(f"Error: Could not set root path in model: {folder}", COLOR_ERROR)
+                    QMessageBox.critical(self, "Model Error", f"Failed to set the file system model root path to:\n{folder}")
+                    return
+                view_root_index = self._to_view_index(source_root_index)
+                if not view_root_index.isValid():
+                    self.log_message(f"Error: Could not map root path to proxy model: {folder}", COLOR_ERROR)
+                self.file_tree.setRootIndex(view_root_index)
+                self._hide_tree_columns()
+                self.file_tree.setSortingEnabled(True)
+                self.file_tree.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+            finally:
+                self.file_tree.setUpdatesEnabled(True)
             self.log_message(f"Selected folder: {folder}", COLOR_INFO)
 
     def _hide_tree_columns(self):
+        """Hides every column except the name column via the header."""
         if self.fs_model:
+            header = self.file_tree.header()
             for i in range(1, self.fs_model.columnCount()):
-                self.file_tree.setColumnHidden(i, True)
+                header.setSectionHidden(i, True)
 
     def filter_file_tree(self, text: str):
-        filter_pattern = f"*{text}*" if text else ""
-        self.proxy_model.setFilterWildcard(filter_pattern)
+        """Records the filter text and (re)starts the debounce timer."""
+        self._pending_filter_text = text
+        if not text:
+            # Clearing is cheap and should feel instant
+            self._filter_debounce.stop()
+            self._apply_filter()
+            return
+        self._filter_debounce.start()
+
+    def _apply_filter(self):
+        """
+        Applies the pending filter text to the tree.
+
+        Plain substrings and simple globs are handed to the file system model's
+        native name filters, which avoids the proxy's recursive per-row walk.
+        Patterns using character classes ([...]) still go through the proxy.
+        """
+        text = self._pending_filter_text
+        name_filter = self._name_filter_for(text)
+        if name_filter is not None:
+            self._set_tree_proxy_active(False)
+            self.fs_model.setNameFilters([name_filter])
+        else:
+            # Restore the plain '*.py' listing before the proxy filters it, so
+            # the proxy never sees the root folder momentarily empty.
+            self.fs_model.setNameFilters(["*.py"])
+            self.proxy_model.setFilterWildcard(f"*{text}*")
+            self._set_tree_proxy_active(True)
+
+    def _set_tree_proxy_active(self, active: bool):
+        """
+        Shows the tree through the filter proxy (active) or straight from the file
+        system model. Without a proxy filter, clicks and menus skip the index
+        mapping and the proxy doesn't track every model change.
+        """
+        if active == self._proxy_active: return
+        current_source_index = self._to_source_index(self.file_tree.currentIndex())
+        self.file_tree.setUpdatesEnabled(False)
+        try:
+            if active:
+                self.proxy_model.setSourceModel(self.fs_model)
+                self._proxy_active = True
+                self.file_tree.setModel(self.proxy_model)
+            else:
+                self._proxy_active = False
+                self.file_tree.setModel(self.fs_model)
+                self.proxy_model.setSourceModel(None)
+            if self.current_folder_path:
+                self.file_tree.setRootIndex(self._to_view_index(self.fs_model.index(self.current_folder_path)))
+                self._hide_tree_columns()
+                self.file_tree.sortByColumn(0, Qt.SortOrder.AscendingOrder)
+                if current_source_index.isValid(): self.file_tree.setCurrentIndex(self._to_view_index(current_source_index))
+        finally:
+            self.file_tree.setUpdatesEnabled(True)
+
+    def _to_source_index(self, view_index: QModelIndex) -> QModelIndex:
+        """Maps a file tree index to the file system model."""
+        return self.proxy_model.mapToSource(view_index) if self._proxy_active else view_index
+
+    def _to_view_index(self, source_index: QModelIndex) -> QModelIndex:
+        """Maps a file system model index to the index shown in the file tree."""
+        return self.proxy_model.mapFromSource(source_index) if self._proxy_active else source_index
+
+    @staticmethod
+    def _name_filter_for(text: str) -> str | None:
+        """Builds a '*.py' name filter for the given text, or None if it needs the proxy."""
+        if not text:
+            return "*.py"
+        if "[" in text or "]" in text:
+            return None
+        stem = text[:-3] if text.lower().endswith(".py") else text
+        return f"*{stem}*.py"
 
 
     # --- MODIFIED: show_tree_context_menu ---
@@ -441,7 +613,7 @@ class App(QWidget):
         if not index.isValid():
             return
 
-        source_index = self.proxy_model.mapToSource(index)
+        source_index = self._to_source_index(index)
         if not source_index.isValid():
             return
 
@@ -450,75 +622,90 @@ class App(QWidget):
         is_dir = self.fs_model.isDir(source_index)
 
         menu = QMenu(self)
+        menu.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
 
         # --- Common Actions ---
-        open_folder_action = QAction(self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon), "Open Containing Folder", self)
         target_folder_path = original_file_path if is_dir else original_file_path.parent
-        open_folder_action.triggered.connect(lambda: self.trigger_open_containing_folder(target_folder_path))
-        menu.addAction(open_folder_action)
-
-        copy_path_action = QAction(self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogContentsView), "Copy Full Path", self)
-        copy_path_action.triggered.connect(lambda: self.trigger_copy_file_path(file_path_str))
-        menu.addAction(copy_path_action)
+        self._add_menu_actions(menu, (
+            (self._standard_icon(QStyle.StandardPixmap.SP_DirIcon), "Open Containing Folder", True,
+             lambda: self.trigger_open_containing_folder(target_folder_path)),
+            (self._standard_icon(QStyle.StandardPixmap.SP_FileDialogContentsView), "Copy Full Path", True,
+             lambda: self.trigger_copy_file_path(file_path_str)),
+        ))
 
         menu.addSeparator()
 
         # --- File-Specific Actions ---
         if not is_dir:
-            # --- Get CENTRAL backup/redo paths ---
-            central_dir, central_backup_path, central_redo_path, path_err = get_central_backup_paths(original_file_path)
+            # --- Get CENTRAL backup/redo paths (cached per file mtime) ---
+            central_backup_path, central_redo_path, backup_exists, redo_exists, path_err = (
+                self._get_backup_meta(original_file_path)
+            )
 
             if path_err:
                 # Show error in context menu if paths can't be determined
-                err_action = QAction(f"Error: {path_err}", self)
-                err_action.setEnabled(False)
-                menu.addAction(err_action)
+                menu.addAction(f"Error: {path_err}").setEnabled(False)
             else:
-                # Only add actions if paths are valid
-                # Check existence of CENTRAL files
-                backup_exists = central_backup_path and central_backup_path.exists()
-                redo_exists = central_redo_path and central_redo_path.exists()
-
-                # Action: Diff Against Backup
-                diff_bak_action = QAction(self.style().standardIcon(QStyle.StandardPixmap.SP_FileLinkIcon), "Diff vs Backup (.bak)", self)
-                diff_bak_action.setEnabled(backup_exists)
-                # Pass ORIGINAL path and CENTRAL backup path to trigger
-                diff_bak_action.triggered.connect(
-                    lambda: self.trigger_diff_against_backup(original_file_path, central_backup_path)
-                )
-                menu.addAction(diff_bak_action)
-
-                # Action: Diff Against Redo State
-                diff_redo_action = QAction(self.style().standardIcon(QStyle.StandardPixmap.SP_FileLinkIcon), "Diff vs Redo (.redo)", self)
-                diff_redo_action.setEnabled(redo_exists)
-                # Pass ORIGINAL path and CENTRAL redo path to trigger
-                diff_redo_action.triggered.connect(
-                    lambda: self.trigger_diff_against_redo(original_file_path, central_redo_path)
-                )
-                menu.addAction(diff_redo_action)
+                # Diff actions receive the ORIGINAL path and the CENTRAL backup/redo path
+                self._add_menu_actions(menu, (
+                    (self._standard_icon(QStyle.StandardPixmap.SP_FileLinkIcon), "Diff vs Backup (.bak)", backup_exists,
+                     lambda: self.trigger_diff_against_backup(original_file_path, central_backup_path)),
+                    (self._standard_icon(QStyle.StandardPixmap.SP_FileLinkIcon), "Diff vs Redo (.redo)", redo_exists,
+                     lambda: self.trigger_diff_against_redo(original_file_path, central_redo_path)),
+                ))
 
                 menu.addSeparator()
 
-                # Action: Restore from Backup
-                restore_bak_action = QAction(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowBack).fromTheme("document-revert"), "Restore from Backup (.bak)", self)
-                restore_bak_action.setEnabled(backup_exists)
-                # Pass ORIGINAL target path and CENTRAL backup source path
-                restore_bak_action.triggered.connect(
-                    lambda: self.trigger_restore_from_source(original_file_path, central_backup_path)
-                )
-                menu.addAction(restore_bak_action)
-
-                # Action: Restore from Redo State
-                restore_redo_action = QAction(self.style().standardIcon(QStyle.StandardPixmap.SP_ArrowForward).fromTheme("document-revert"), "Restore from Redo (.redo)", self)
-                restore_redo_action.setEnabled(redo_exists)
-                # Pass ORIGINAL target path and CENTRAL redo source path
-                restore_redo_action.triggered.connect(
-                    lambda: self.trigger_restore_from_source(original_file_path, central_redo_path)
-                )
-                menu.addAction(restore_redo_action)
+                # Restore actions receive the ORIGINAL target path and the CENTRAL source path
+                self._add_menu_actions(menu, (
+                    (self._theme_icon("document-revert"), "Restore from Backup (.bak)", backup_exists,
+                     lambda: self.trigger_restore_from_source(original_file_path, central_backup_path)),
+                    (self._theme_icon("document-revert"), "Restore from Redo (.redo)", redo_exists,
+                     lambda: self.trigger_restore_from_source(original_file_path, central_redo_path)),
+                ))
 
         # Show menu
         menu.exec(self.file_tree.viewport().mapToGlobal(position))
+        menu.close()
+
+    @staticmethod
+    def _add_menu_actions(menu: QMenu, entries):
+        """Adds (icon, label, enabled, slot) entries to the menu."""
+        for icon, label, enabled, slot in entries:
+            action = menu.addAction(icon, label)
+            action.setEnabled(bool(enabled))
+            action.triggered.connect(slot)
+
+    def _get_backup_meta(self, file_path: Path) -> tuple[Path | None, Path | None, bool, bool, str | None]:
+        """
+        Returns (backup_path, redo_path, backup_exists, redo_exists, error) for a file.
+
+        Results are cached against the file's mtime, so repeated right-clicks do not
+        hit the filesystem again. Our own write paths call _invalidate_file_caches.
+        """
+        try:
+            mtime = file_path.stat().st_mtime
+        except OSError:
+            mtime = -1.0
+
+        cached = self._bak_meta_cache.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1:]
+
+        _central_dir, backup_path, redo_path, path_err = get_central_backup_paths(file_path)
+        backup_exists = bool(backup_path and backup_path.exists())
+        redo_exists = bool(redo_path and redo_path.exists())
+        entry = (mtime, backup_path, redo_path, backup_exists, redo_exists, path_err)
+
+        if len(self._bak_meta_cache) >= self._BAK_META_CACHE_MAX:
+            self._bak_meta_cache.pop(next(iter(self._bak_meta_cache)))  # Drop the oldest entry
+        self._bak_meta_cache[file_path] = entry
+        return entry[1:]
+
+    def _invalidate_file_caches(self, file_path: Path):
+        """Drops cached per-file state after the app modifies the file or its backups."""
+        self._bak_meta_cache.pop(file_path, None)
+        ast_cache.invalidate(file_path)
 
 
     # --- Context Menu Trigger Methods ---
@@ -564,44 +751,43 @@ class App(QWidget):
     # _show_diff_dialog_helper remains IDENTICAL (it takes any two paths)
     def _show_diff_dialog_helper(self, file1_path: Path, file2_path: Path, title_prefix: str):
         """Helper method to read files and display the DiffDialog."""
-        # ... (No changes needed inside this helper) ...
-        if not file1_path.exists():
+        # One stat per file; the results double as the existence check and the read hint
+        file1_stat, _ = probe_path(file1_path)
+        if file1_stat is None:
             QMessageBox.warning(self, "Diff Error", f"File not found: {file1_path.name}")
             return
         # Check the *second* path (which might be the central backup/redo)
-        if not file2_path.exists():
+        file2_stat, _ = probe_path(file2_path)
+        if file2_stat is None:
             QMessageBox.warning(self, "Diff Error", f"Comparison file not found: {file2_path}") # Show full path for central files
             return
 
         try:
-            content1, err1 = safe_read_file(file1_path)
-            content2, err2 = safe_read_file(file2_path)
+            content1, err1 = safe_read_file(file1_path, file1_stat)
+            content2, err2 = safe_read_file(file2_path, file2_stat)
 
             if err1: raise ValueError(f"Error reading {file1_path.name}: {err1}")
             if err2: raise ValueError(f"Error reading comparison file {file2_path.name}: {err2}")
 
-            lines1 = content1.splitlines() if content1 is not None else []
-            lines2 = content2.splitlines() if content2 is not None else []
+            # Identical content (common right after a no-op format/restore): skip splitting and difflib entirely
+            if content1 == content2:
+                self.log_message(f"{title_prefix}: '{file1_path.name}' is identical to '{file2_path.name}'.", COLOR_INFO)
+                QMessageBox.information(self, "No Differences", f"'{file1_path.name}' and '{file2_path.name}' are identical.")
+                return
+
+            lines1 = split_lines(content1) if content1 is not None else []
+            lines2 = split_lines(content2) if content2 is not None else []
 
             # Use relative names for dialog clarity if possible, or full path for central
             fdesc1 = f"a/{file1_path.name}"
             fdesc2 = f"b/{file2_path.name}" # Default name
-            # Heuristic: if file2 is likely in the central backup dir, show more path?
-            try:
-                # Check if file2_path shares the central backup dir root
-                home_dir = Path.home()
-                central_backup_dir_root = home_dir / CODE_HELPER_BACKUP_DIR_NAME
-                if file2_path.is_relative_to(central_backup_dir_root):
-                   # Show path relative to central backup dir? Or just name + (central)?
-                   fdesc2 = f"b/{file2_path.name} (Backup)" # Keep it simple
-            except ValueError: # is_relative_to can fail if paths are different drives
-                 pass
-            except Exception: # Catch other potential errors in this heuristic
-                 pass
+            # Heuristic: if file2 is in the central backup dir, label it as a backup
+            if os.path.normcase(str(file2_path)).startswith(self._central_backup_root_prefix):
+                fdesc2 = f"b/{file2_path.name} (Backup)" # Keep it simple
 
             dialog = DiffDialog(lines1, lines2, fromdesc=fdesc1, todesc=fdesc2, parent=self)
             dialog_title = f"{title_prefix} - {file1_path.name}"
-            dialog.setWindowTitle(dialog_title[:120])
+            dialog.setWindowTitle(dialog_title[:DIALOG_TITLE_MAX_LENGTH])
             dialog.exec()
 
         except Exception as e:
@@ -614,7 +800,7 @@ class App(QWidget):
     def trigger_restore_from_source(self, target_file: Path, source_file: Path):
         """Handles restoring a file from a central source (.bak or .redo) after confirmation."""
         # source_file is now expected to be the central backup/redo path
-        if not source_file or not source_file.exists():
+        if not source_file or probe_path(source_file)[0] is None:
             QMessageBox.warning(self, "Restore Error", f"Central source file not found or invalid: {source_file}")
             return
 
@@ -634,22 +820,23 @@ class App(QWidget):
                 if not os.access(str(source_file), os.R_OK):
                     raise PermissionError(f"Permission denied reading source file: {source_file}")
 
-                # Check write permission for ORIGINAL target (or its directory)
-                can_write_target = (target_file.exists() and os.access(str(target_file), os.W_OK)) or \
-                                   (not target_file.exists() and os.access(str(target_file.parent), os.W_OK))
+                # Check write permission for ORIGINAL target (or its directory); stat it once
+                target_exists = probe_path(target_file)[0] is not None
+                can_write_target = os.access(str(target_file), os.W_OK) if target_exists else os.access(str(target_file.parent), os.W_OK)
                 if not can_write_target:
-                    perm_issue = f"writing to file {target_file.name}" if target_file.exists() else f"writing to directory {target_file.parent}"
+                    perm_issue = f"writing to file {target_file.name}" if target_exists else f"writing to directory {target_file.parent}"
                     raise PermissionError(f"Permission denied {perm_issue}")
 
                 # Create .redo state from the *current* ORIGINAL target file *before* overwriting it.
                 # backup_and_redo handles storing this new redo state CENTRALLY.
-                if target_file.exists():
+                if target_exists:
                     backup_ok, backup_err = backup_and_redo(target_file)
                     if not backup_ok:
                         raise OSError(f"Could not create central undo state (.redo) before restoring: {backup_err}")
 
-                # Perform Restore: Copy from CENTRAL source to ORIGINAL target
-                shutil.copy2(str(source_file), str(target_file))
+                # Perform Restore: Copy content from CENTRAL source to ORIGINAL target; the target keeps its own permissions
+                fast_copy(source_file, target_file, copy_metadata=False)
+                self._invalidate_file_caches(target_file)
 
                 self.log_message(f"Restored '{target_file.name}' from central {source_type} '{source_file.name}'", COLOR_SUCCESS)
 
@@ -677,35 +864,61 @@ class App(QWidget):
     def _perform_reset(self):
         if self.scan_thread and self.scan_thread.isRunning(): print("Warning: Scan thread did not stop quickly during reset.")
         if self.replace_thread and self.replace_thread.isRunning(): print("Warning: Replace thread did not stop quickly during reset.")
-        self.find_input.clear()
-        self.replace_input.clear()
-        self.regex_checkbox.setChecked(False)
-        self.filter_input.clear()
-        self.find_bar_input.clear()
-        self.find_bar_case_checkbox.setChecked(False)
-        self.find_bar_input.setPalette(self.new_code_editor.palette())
-        self.preview_area.setReadOnly(False); self.preview_area.clear(); self.preview_area.setReadOnly(True)
-        self.new_code_editor.clear()
-        self.log_area.clear()
-        self.progress_bar.setValue(0); self.progress_bar.setFormat("%p%")
-        self.file_tree.clearSelection()
-        self.files = []
-        self._pending_patch_info = None
-        self.apply_snippet_btn.setEnabled(False)
-        self.scan_btn.setEnabled(True)
-        self.cancel_btn.setEnabled(False)
+        self.setUpdatesEnabled(False)  # One repaint for the whole reset instead of one per widget
+        try:
+            self.find_input.clear()
+            self.replace_input.clear()
+            self.regex_checkbox.setChecked(False)
+            self.filter_input.clear()
+            self.find_bar_input.clear()
+            self.find_bar_case_checkbox.setChecked(False)
+            self._reset_find_bar_palette()
+            self.preview_area.setReadOnly(False); self.preview_area.clear(); self.preview_area.setReadOnly(True)
+            self._preview_loaded = None
+            self._pending_preview_path = None; self._preview_load_timer.stop()
+            self.new_code_editor.clear()
+            self._log_queue.clear(); self.log_area.clear()
+            self.progress_bar.setValue(0); self.progress_bar.setFormat("%p%")
+            self.file_tree.clearSelection()
+            self.files = []
+            self._pending_patch_info = None
+            self.apply_snippet_btn.setEnabled(False)
+            self.scan_btn.setEnabled(True)
+            self.cancel_btn.setEnabled(False)
+        finally:
+            self.setUpdatesEnabled(True)
         self.log_message("UI Reset.", COLOR_INFO); print("UI Reset performed.")
 
-    def log_message(self, message: str, color: str = COLOR_DEFAULT_TEXT, is_html: bool = False):
+    def log_message(self, message: str, color: str = COLOR_DEFAULT_TEXT):
+        """Queues a log line; queued lines are written in one batch by _flush_log_queue."""
         if not hasattr(self, "log_area"): return
-        log_entry = ""
-        if is_html:
-            log_entry = f'<font color="{color}">{message}</font>'
-        else:
-            escaped_message = message.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\n", "<br>")
-            log_entry = f'<font color="{color}">{escaped_message}</font>'
-        self.log_area.append(log_entry)
-        QTimer.singleShot(0, lambda: self.log_area.verticalScrollBar().setValue(self.log_area.verticalScrollBar().maximum()))
+        self._log_queue.append((message, color))
+        if not self._log_flush_timer.isActive(): self._log_flush_timer.start()
+
+    def _log_format(self, color: str) -> QTextCharFormat:
+        log_format = self._log_formats.get(color)
+        if log_format is None:
+            log_format = QTextCharFormat(); log_format.setForeground(QColor(color))
+            self._log_formats[color] = log_format
+        return log_format
+
+    def _flush_log_queue(self):
+        if not self._log_queue: return
+        cursor = QTextCursor(self.log_area.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        # Entries beyond the block limit would be trimmed right after insertion, so don't insert them
+        dropped = len(self._log_queue) - LOG_MAX_BLOCKS
+        for _ in range(dropped): self._log_queue.popleft()
+        cursor.beginEditBlock()
+        while self._log_queue:
+            message, color = self._log_queue.popleft()
+            if not self.log_area.document().isEmpty(): cursor.insertBlock()
+            # Consecutive entries in the same color go in with one insertText call
+            lines = [message]
+            while self._log_queue and self._log_queue[0][1] == color: lines.append(self._log_queue.popleft()[0])
+            cursor.insertText("\n".join(lines), self._log_format(color))
+        cursor.endEditBlock()
+        scroll_bar = self.log_area.verticalScrollBar(); scroll_bar.setValue(scroll_bar.maximum())
 
     # --- Thread Handling ---
     # handle_thread_error, cancel_operation, scan_and_run, scan_finished_or_cancelled, run_replacement, update_progress, handle_replacement_error, replacement_finished
@@ -737,6 +950,12 @@ class App(QWidget):
         pattern = self.find_input.text()
         replacement = self.replace_input.text()
         use_regex = self.regex_checkbox.isChecked()
+        if use_regex and pattern:
+            # Compile once here; every worker reuses the compiled pattern
+            pattern, regex_error = compile_find_pattern(pattern)
+            if regex_error:
+                QMessageBox.warning(self, "Invalid Regex", f"The find pattern is not a valid regular expression:\n{regex_error}")
+                return
         self.log_message(f"Starting scan in '{Path(self.current_folder_path).name}'...", COLOR_DEFAULT_TEXT)
         self.progress_bar.setValue(0); self.progress_bar.setFormat("Scanning... %p%")
         self.scan_btn.setEnabled(False); self.cancel_btn.setEnabled(True)
@@ -746,6 +965,7 @@ class App(QWidget):
             self.scan_thread.files_loaded.connect(lambda files, folder_path: self.run_replacement(files, pattern, replacement, use_regex))
             self.scan_thread.error_occurred.connect(self.handle_thread_error)
             self.scan_thread.finished.connect(self.scan_finished_or_cancelled)
+            self.scan_thread.finished.connect(self._maybe_finalize_close)
             self.scan_thread.start()
         except Exception as e:
             error_msg = f"Failed to start file scanning thread: {e}"; self.log_message(error_msg, COLOR_ERROR)
@@ -759,7 +979,7 @@ class App(QWidget):
             self.scan_btn.setEnabled(True); self.cancel_btn.setEnabled(False)
             self.progress_bar.setValue(0); self.progress_bar.setFormat("%p%")
 
-    def run_replacement(self, files: list[Path], pattern: str, replacement: str, use_regex: bool):
+    def run_replacement(self, files: list[Path], pattern: str | re.Pattern, replacement: str, use_regex: bool):
         print(f"run_replacement called with {len(files)} files.")
         self.files = files
         if self.scan_thread and not self.scan_thread._is_running:
@@ -779,8 +999,10 @@ class App(QWidget):
                 return
             self.replace_thread = ReplacementThread(self.files, pattern, replacement, use_regex, parent=self)
             self.replace_thread.progress.connect(self.update_progress)
+            self.replace_thread.progress_batch.connect(self.update_progress_batch)
             self.replace_thread.error_occurred.connect(self.handle_replacement_error)
             self.replace_thread.finished.connect(self.replacement_finished)
+            self.replace_thread.finished.connect(self._maybe_finalize_close)
             self.replace_thread.start()
         except Exception as e:
             error_msg = f"Failed to start replacement thread: {e}"; self.log_message(error_msg, COLOR_ERROR)
@@ -789,31 +1011,18 @@ class App(QWidget):
 
     def update_progress(self, progress_percent: int, log_msg: str):
         self.progress_bar.setValue(progress_percent)
-        color = COLOR_DEFAULT_TEXT; is_html = False
         log_summary = log_msg.splitlines()[0] if "\n" in log_msg else log_msg
-        if ("[Error]" in log_summary or "[Read Error]" in log_summary or "[Replace Error]" in log_summary or
-            "[Write Error]" in log_summary or "[Backup/Redo Error]" in log_summary or "Permission denied" in log_summary or
-            "Invalid regex" in log_summary or "Cannot decode" in log_summary or "formatting failed" in log_summary):
-            color = COLOR_ERROR; self.log_message(log_msg, color, is_html=False)
-        elif "[Updated]" in log_summary or "[Updated with Format Warning]" in log_summary or "[Updated with Replace Error]" in log_summary:
-            color = COLOR_SUCCESS
-            if "[Updated with Format Warning]" in log_summary or "[Updated with Replace Error]" in log_summary: color = COLOR_WARNING
-            summary_line = log_summary.replace("<", "&lt;").replace(">", "&gt;")
-            diff_html = ""
-            if "\nDiff:\n" in log_msg:
-                try:
-                    diff_part = log_msg.split("\nDiff:\n", 1)[1]
-                    escaped_diff_lines = [l.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;") for l in diff_part.splitlines()]
-                    diff_html = (f'<pre style="color:{COLOR_INFO}; margin-top: 2px; margin-bottom: 0px; white-space: pre-wrap; font-size: 9pt;">'
-                                 f"{'<br>'.join(escaped_diff_lines)}</pre>")
-                except Exception as e:
-                    print(f"Error processing diff for logging: {e}"); diff_html = f"<br><i>(Error displaying diff)</i>"
-            log_html = f'<font color="{color}">{summary_line}</font>{diff_html}"'
-            self.log_message(log_html, is_html=True)
-        elif "[Format Warning]" in log_summary: color = COLOR_WARNING; self.log_message(log_msg, color, is_html=False)
-        elif "[No change]" in log_summary: color = COLOR_INFO; self.log_message(log_msg, color, is_html=False)
-        elif "[Cancelled]" in log_summary or "[Skipped]" in log_summary: color = COLOR_WARNING; self.log_message(log_msg, color, is_html=False)
-        else: self.log_message(log_msg, color, is_html=False)
+        if self._PROGRESS_ERROR_RE.search(log_summary): self.log_message(log_msg, COLOR_ERROR); return
+        tag_match = self._PROGRESS_TAG_RE.search(log_summary)
+        if tag_match is None: self.log_message(log_msg, COLOR_DEFAULT_TEXT); return
+        tag = tag_match.group(1); color = self._PROGRESS_TAG_COLORS[tag]
+        if tag.startswith("Updated"):
+            self.log_message(log_summary, color)
+            if "\nDiff:\n" in log_msg: self.log_message(log_msg.split("\nDiff:\n", 1)[1], COLOR_INFO)
+        else: self.log_message(log_msg, color)
+
+    def update_progress_batch(self, batch: list[tuple[int, str]]):
+        for progress_percent, log_msg in batch: self.update_progress(progress_percent, log_msg)
 
     def handle_replacement_error(self, error_message: str): pass
 
@@ -835,20 +1044,44 @@ class App(QWidget):
     # remain IDENTICAL
 
     def on_tree_clicked(self, index: QModelIndex):
-        if not index.isValid(): self._clear_and_disable_on_selection_change(); return
-        source_index = self.proxy_model.mapToSource(index)
-        if not source_index.isValid(): self._clear_and_disable_on_selection_change(); return
-        if self.fs_model.isDir(source_index): self._clear_and_disable_on_selection_change(); return
-        file_path_str = self.fs_model.filePath(source_index)
-        self._load_file_into_preview(Path(file_path_str))
-
-    def _load_file_into_preview(self, file_path: Path):
         self._clear_and_disable_on_selection_change()
-        content, error_msg = safe_read_file(file_path)
+        self._pending_preview_path = None; self._preview_load_timer.stop()
+        if not index.isValid(): return
+        source_index = self._to_source_index(index)
+        if not source_index.isValid() or self.fs_model.isDir(source_index): return
+        # Debounced: of several quick clicks, only the last file is read and shown
+        self._pending_preview_path = Path(self.fs_model.filePath(source_index)); self._preview_load_timer.start()
+
+    def _load_pending_preview(self):
+        file_path = self._pending_preview_path; self._pending_preview_path = None
+        if file_path is None: return
+        if self._preview_loaded is not None and self._preview_loaded == self._preview_key(file_path):
+            return  # Same unchanged file: keep the document (and highlighting)
+        self._load_file_into_preview(file_path)
+
+    @staticmethod
+    def _preview_key(file_path: Path) -> tuple[Path, int, int] | None:
+        try: stat_result = file_path.stat()
+        except OSError: return None
+        return file_path, stat_result.st_mtime_ns, stat_result.st_size
+
+    def _load_file_into_preview(self, file_path: Path, known_content: str | None = None):
+        """Shows file_path in the preview. known_content: text the app just wrote to the file, used instead of reading it back."""
+        self._clear_and_disable_on_selection_change()
+        preview_key = self._preview_key(file_path)  # Taken before reading, so a concurrent change forces a reload later
+        if known_content is not None:
+            # Reading back in text mode would turn any \r\n or \r written to disk into \n
+            content, error_msg = (known_content.replace("\r\n", "\n").replace("\r", "\n") if "\r" in known_content else known_content), None
+        elif preview_key is not None and preview_key[2] > PREVIEW_MAX_FILE_BYTES:
+            content, error_msg = read_file_head(file_path, PREVIEW_TRUNCATED_BYTES) # Display only; the preview is read-only
+            if content is not None: content += f"\n# (truncated: showing the first {PREVIEW_TRUNCATED_BYTES // 1024} KB of {preview_key[2] // 1024} KB)"
+        else: content, error_msg = safe_read_file(file_path)
+        self._preview_loaded = preview_key if content is not None and not error_msg else None
         self.preview_area.setReadOnly(False)
         if error_msg:
             self.preview_area.setPlainText(f"# Error loading preview:\n# {error_msg}"); self.log_message(f"Preview Error: {error_msg}", COLOR_ERROR)
         elif content is not None:
+            self.highlighter_preview.prepare_for_bulk_text(content.count("\n") + 1)
             self.preview_area.setPlainText(content); self.preview_area.moveCursor(self.preview_area.textCursor().MoveOperation.Start)
         else:
             self.preview_area.setPlainText(f"# Error: Could not read file {file_path.name}, reason unknown."); self.log_message(f"Preview Error: Unknown issue reading {file_path.name}", COLOR_ERROR)
@@ -862,9 +1095,9 @@ class App(QWidget):
     # This helper is now ONLY used to get the *original* selected file path.
     def _get_selected_source_index_and_path(self,) -> tuple[QModelIndex | None, Path | None]:
         """Gets the source model index and Path object for the currently selected file."""
-        current_proxy_index = self.file_tree.currentIndex()
-        if not current_proxy_index.isValid(): return None, None
-        source_index = self.proxy_model.mapToSource(current_proxy_index)
+        current_view_index = self.file_tree.currentIndex()
+        if not current_view_index.isValid(): return None, None
+        source_index = self._to_source_index(current_view_index)
         if not source_index.isValid() or self.fs_model.isDir(source_index): return None, None
         file_path = Path(self.fs_model.filePath(source_index))
         return source_index, file_path
@@ -872,12 +1105,12 @@ class App(QWidget):
 
     # _refresh_preview_after_change, _refresh_preview_if_selected
     # remain IDENTICAL
-    def _refresh_preview_after_change(self, file_path: Path):
+    def _refresh_preview_after_change(self, file_path: Path, known_content: str | None = None):
         try:
             current_source_index, current_file_path = self._get_selected_source_index_and_path()
             if current_file_path == file_path:
                 print(f"Refreshing preview for modified file: {file_path.name}")
-                self._load_file_into_preview(file_path)
+                self._load_file_into_preview(file_path, known_content)
         except Exception as e:
             print(f"Error during preview refresh for {file_path.name}: {e}")
             self.log_message(f"Warning: Error refreshing preview for {file_path.name}: {e}", COLOR_WARNING)
@@ -888,19 +1121,49 @@ class App(QWidget):
 
 
     # --- Code Editor Actions ---
-    # format_new_code, apply_new_code, preview_diff, preview_snippet_change, apply_snippet_patch
-    # remain IDENTICAL to previous version (Black integration)
+    # format_new_code, apply_new_code, preview_diff and preview_snippet_change run Black on the
+    # thread pool (see _start_format_job) and finish in the matching _finish_* method
+
+    def _start_format_job(self, code_string: str, on_done, follow_up=None) -> bool:
+        """
+        Runs preprocess_and_format_with_black on the thread pool and calls
+        on_done(processed_code, error_message) back on the GUI thread.
+        With a follow_up (see FormatWorker), it also runs on the pool and its result
+        is passed on: on_done(processed_code, error_message, follow_up_result).
+        The editor action buttons stay disabled while the job runs.
+        Returns False (and does nothing) if a job is already running.
+        """
+        if self._format_worker is not None: self.log_message("Formatting is already in progress, please wait.", COLOR_WARNING); return False
+        worker = FormatWorker(code_string, follow_up)
+        def finished(processed_code: str, error_message: str | None, follow_up_result):
+            self._format_worker = None; self._set_format_buttons_enabled(True)
+            if follow_up is None: on_done(processed_code, error_message)
+            else: on_done(processed_code, error_message, follow_up_result)
+        worker.signals.finished.connect(finished)
+        self._format_worker = worker # Keeps the worker and its signals object alive until delivery
+        self._set_format_buttons_enabled(False)
+        QThreadPool.globalInstance().start(worker)
+        return True
+
+    def _set_format_buttons_enabled(self, enabled: bool):
+        for button in (self.format_code_btn, self.preview_diff_btn, self.preview_snippet_btn, self.apply_new_code_btn): button.setEnabled(enabled)
 
     def format_new_code(self):
         editor = self.new_code_editor; current_code = editor.toPlainText()
         if not current_code.strip(): QMessageBox.warning(self,"No Code","The code editor is empty. Paste some Python code first."); return
+        self._start_format_job(current_code, lambda code, err: self._finish_format_new_code(current_code, code, err))
+
+    def _finish_format_new_code(self, current_code: str, formatted_code: str, format_error: str | None):
+        editor = self.new_code_editor
         try:
-            formatted_code, format_error = preprocess_and_format_with_black(current_code)
             if format_error:
                 QMessageBox.warning(self,"Cleaning/Formatting Error",f"Could not clean or format the pasted code:\n{format_error}")
                 self.log_message(f"Pasted code cleaning/formatting failed: {format_error}", COLOR_ERROR)
+            elif editor.toPlainText() != current_code:
+                self.log_message("Editor content changed while formatting; formatted result discarded.", COLOR_WARNING)
             else:
                 cursor = editor.textCursor(); original_pos = cursor.position(); original_anchor = cursor.anchor(); has_selection = cursor.hasSelection()
+                self.highlighter_new_code.prepare_for_bulk_text(formatted_code.count("\n") + 1)
                 editor.setPlainText(formatted_code)
                 new_length = len(formatted_code); cursor.setPosition(min(original_anchor, new_length))
                 if has_selection: cursor.setPosition(min(original_pos, new_length), cursor.MoveMode.KeepAnchor)
@@ -919,9 +1182,11 @@ class App(QWidget):
             reply = QMessageBox.question(self,"Apply Empty Content?",f"The code editor is empty. Apply empty content to overwrite '{file_path.name}'?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel, QMessageBox.StandardButton.Cancel)
             if reply == QMessageBox.StandardButton.Cancel: return
         self._clear_and_disable_on_selection_change()
+        self._start_format_job(new_code_raw, lambda code, err: self._finish_apply_new_code(file_path, new_code_raw, code, err))
+
+    def _finish_apply_new_code(self, file_path: Path, new_code_raw: str, processed_code: str, process_error: str | None):
         final_code_to_write = ""; log_color = COLOR_SUCCESS; log_suffix = "."
         try:
-            processed_code, process_error = preprocess_and_format_with_black(new_code_raw)
             if process_error:
                 reply = QMessageBox.warning(self,"Formatting Error", f"Black failed to format the code:\n{process_error}\n\nDo you want to apply the code *after cleaning/normalization but without Black formatting*?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
                 if reply == QMessageBox.StandardButton.No: self.log_message(f"Apply Full File cancelled due to formatting error on {file_path.name}.", COLOR_WARNING); return
@@ -942,9 +1207,10 @@ class App(QWidget):
             write_ok, write_err = safe_write_file(file_path, final_code_to_write)
             if not write_ok:
                 error_msg = f"Failed to write changes to {file_path.name}: {write_err}"; self.log_message(error_msg, COLOR_ERROR); QMessageBox.critical(self, "File Write Error", error_msg); return
+            self._invalidate_file_caches(file_path)
             self.log_message(f"Applied editor content to {file_path.name}{log_suffix}", log_color)
-            self._refresh_preview_after_change(file_path)
-            self.new_code_editor.clear()
+            self._refresh_preview_after_change(file_path, final_code_to_write)
+            if self.new_code_editor.toPlainText() == new_code_raw: self.new_code_editor.clear() # Keep anything typed while formatting
         except Exception as e:
             error_msg = f"Unexpected error applying code to {file_path.name}: {e}"; self.log_message(error_msg, COLOR_ERROR)
             traceback.print_exc(); QMessageBox.critical(self, "Apply Error", error_msg)
@@ -955,21 +1221,27 @@ class App(QWidget):
         new_code_raw = self.new_code_editor.toPlainText()
         if not new_code_raw.strip(): QMessageBox.warning(self, "Editor Empty", "Paste code into the editor to compare."); return
         self._clear_and_disable_on_selection_change()
+        self._start_format_job(new_code_raw, lambda code, err: self._finish_preview_diff(file_path, code, err))
+
+    def _finish_preview_diff(self, file_path: Path, processed_code: str, process_error: str | None):
         try:
             original_content, read_error = safe_read_file(file_path)
             if read_error: QMessageBox.critical(self,"File Read Error",f"Could not read selected file '{file_path.name}':\n{read_error}"); return
-            original_lines = original_content.splitlines() if original_content is not None else []
-            processed_code, process_error = preprocess_and_format_with_black(new_code_raw)
+            if not process_error and processed_code == original_content:
+                # Nothing to diff: skip splitting and difflib
+                self.log_message(f"Formatted pasted code is identical to {file_path.name}.", COLOR_INFO)
+                QMessageBox.information(self, "No Differences", f"The cleaned/formatted pasted code is identical to '{file_path.name}'."); return
+            original_lines = split_lines(original_content) if original_content is not None else []
             if process_error:
                 reply = QMessageBox.warning(self,"Formatting Error",f"Could not format pasted code with Black:\n{process_error}\n\nShow diff against the *preprocessed* pasted code?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.Yes)
                 if reply == QMessageBox.StandardButton.No: return
-                new_lines = processed_code.splitlines(); to_desc = f"b/{file_path.name} (Pasted - Preprocessed)"
+                new_lines = split_lines(processed_code); to_desc = f"b/{file_path.name} (Pasted - Preprocessed)"
                 self.log_message("Previewing diff against preprocessed pasted code due to Black error.", COLOR_WARNING)
             else:
-                new_lines = processed_code.splitlines(); to_desc = f"b/{file_path.name} (Pasted - Cleaned & Formatted)"
+                new_lines = split_lines(processed_code); to_desc = f"b/{file_path.name} (Pasted - Cleaned & Formatted)"
                 self.log_message(f"Previewing diff for {file_path.name} vs cleaned/formatted pasted code.", COLOR_INFO)
             diff_dialog = DiffDialog(original_lines, new_lines, fromdesc=f"a/{file_path.name} (Current)", todesc=to_desc, parent=self)
-            dialog_title = f"Diff Preview (Full): {file_path.name}"; diff_dialog.setWindowTitle(dialog_title[:120]); diff_dialog.exec()
+            dialog_title = f"Diff Preview (Full): {file_path.name}"; diff_dialog.setWindowTitle(dialog_title[:DIALOG_TITLE_MAX_LENGTH]); diff_dialog.exec()
         except Exception as e:
             error_msg = f"Failed to generate full diff: {e}"; self.log_message(error_msg, COLOR_ERROR)
             traceback.print_exc(); QMessageBox.critical(self, "Diff Error", error_msg)
@@ -981,39 +1253,55 @@ class App(QWidget):
         snippet_text_raw = self.new_code_editor.toPlainText().strip()
         if not snippet_text_raw: QMessageBox.warning(self,"No Snippet","Paste the code snippet (function or class) into the editor below."); return
         if not file_path.exists(): QMessageBox.warning(self, "File Not Found", f"Selected target file not found:\n{file_path}"); return
+        # Reading and parsing the target file happen on the pool thread too, right after Black
+        self._start_format_job(snippet_text_raw, lambda code, err, located: self._finish_preview_snippet_change(file_path, code, err, located),
+                               follow_up=lambda code, err: None if err else self._locate_snippet_target(file_path, code))
+
+    @staticmethod
+    def _locate_snippet_target(file_path: Path, processed_snippet: str) -> tuple[PendingPatch | None, tuple | None]:
+        """
+        Finds the definition in file_path that the (formatted) snippet replaces. Runs on the thread pool
+        as the format job's follow-up, so it only reads and parses and never touches widgets.
+        Returns (patch info, None), or (None, (QMessageBox function, title, text)) to report on the GUI thread.
+        """
+        try: snippet_tree = ast.parse(processed_snippet)
+        except SyntaxError as e: return None, (QMessageBox.warning,"Invalid Snippet Syntax",f"Snippet has syntax errors even after processing:\nAST Parsing Syntax Error: {e}")
+        target_name = None; target_type = "block"
+        # The definition is a top-level statement of the snippet, so there is no need to walk nested nodes
+        snippet_def = next((node for node in snippet_tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))), None)
+        if snippet_def is not None:
+            target_name = snippet_def.name
+            target_type = "class" if isinstance(snippet_def, ast.ClassDef) else "function"
+        if not target_name: return None, (QMessageBox.warning,"Cannot Identify Snippet Target","Could not find a function or class definition at the beginning of the pasted snippet using AST analysis.")
+        file_stamp = App._preview_key(file_path)  # Taken before reading; apply reuses the lines below only while it still matches
+        original_content, read_error = safe_read_file(file_path)
+        if read_error: return None, (QMessageBox.critical,"File Read Error",f"Could not read target file '{file_path.name}':\n{read_error}")
+        target_range, find_node_err = ast_cache.find_ast_node_in_file(file_path, original_content, target_name)
+        if find_node_err: return None, (QMessageBox.warning,"Target File Syntax Error",f"Could not accurately find '{target_name}' in '{file_path.name}' due to a syntax error in that file:\n{find_node_err}")
+        if not target_range: return None, (QMessageBox.warning,"Target Not Found",f"Could not find {target_type} '{target_name}' in the target file '{file_path.name}' using AST.\n(Check spelling or ensure the definition exists).")
+        start_line_index, end_line_index, _node_type = target_range
+        if start_line_index < 0 or end_line_index is None or end_line_index <= start_line_index: return None, (QMessageBox.critical,"AST Line Number Error",f"AST returned invalid line numbers for '{target_name}': start={start_line_index + 1}, end={end_line_index}")
+        original_lines = split_lines(original_content)
+        if start_line_index >= len(original_lines) or end_line_index > len(original_lines): return None, (QMessageBox.critical,"AST Line Number Error",f"AST line numbers ({start_line_index + 1}-{end_line_index}) are out of bounds for file '{file_path.name}' (Total lines: {len(original_lines)})")
+        return PendingPatch(file_path, start_line_index, end_line_index, split_lines(processed_snippet), target_name, target_type,
+                            original_lines, original_content.endswith(("\n", "\r")), file_stamp), None
+
+    def _finish_preview_snippet_change(self, file_path: Path, processed_snippet: str, process_error: str | None, located):
         try:
-            processed_snippet, process_error = preprocess_and_format_with_black(snippet_text_raw)
             if process_error: QMessageBox.warning(self,"Snippet Processing Error",f"Could not clean or format the pasted snippet (check syntax or Black issues):\n{process_error}"); return
-            snippet_node, ast_parse_err = find_ast_node(processed_snippet, "")
-            if ast_parse_err: QMessageBox.warning(self,"Invalid Snippet Syntax",f"Snippet has syntax errors even after processing:\n{ast_parse_err}"); return
-            target_name = None; target_type = "block"
-            try:
-                snippet_tree = ast.parse(processed_snippet)
-                for node in ast.walk(snippet_tree):
-                    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                        target_name = node.name
-                        target_type = "function" if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else "class"
-                        break
-            except Exception as e: QMessageBox.critical(self, "Snippet AST Error", f"Error analyzing snippet structure: {e}"); return
-            if not target_name: QMessageBox.warning(self,"Cannot Identify Snippet Target","Could not find a function or class definition at the beginning of the pasted snippet using AST analysis."); return
-            self.log_message(f"Snippet identified as {target_type} '{target_name}'. Looking in target file...", COLOR_INFO)
-            original_content, read_error = safe_read_file(file_path)
-            if read_error: QMessageBox.critical(self,"File Read Error",f"Could not read target file '{file_path.name}':\n{read_error}"); return
-            target_node, find_node_err = find_ast_node(original_content, target_name)
-            if find_node_err: QMessageBox.warning(self,"Target File Syntax Error",f"Could not accurately find '{target_name}' in '{file_path.name}' due to a syntax error in that file:\n{find_node_err}"); return
-            if not target_node: QMessageBox.warning(self,"Target Not Found",f"Could not find {target_type} '{target_name}' in the target file '{file_path.name}' using AST.\n(Check spelling or ensure the definition exists)."); return
-            start_line_index = target_node.lineno - 1; end_line_index = target_node.end_lineno
-            if start_line_index < 0 or end_line_index is None or end_line_index <= start_line_index: QMessageBox.critical(self,"AST Line Number Error",f"AST returned invalid line numbers for '{target_name}': start={start_line_index + 1}, end={end_line_index}"); return
-            original_lines = original_content.splitlines()
-            if start_line_index >= len(original_lines) or end_line_index > len(original_lines): QMessageBox.critical(self,"AST Line Number Error",f"AST line numbers ({start_line_index + 1}-{end_line_index}) are out of bounds for file '{file_path.name}' (Total lines: {len(original_lines)})"); return
-            existing_block_lines = original_lines[start_line_index:end_line_index]
-            snippet_lines = processed_snippet.splitlines()
+            if isinstance(located, Exception): raise located # Unexpected error in _locate_snippet_target
+            patch, problem = located
+            if problem: show_message, title, text = problem; show_message(self, title, text); return
+            target_name = patch.target_name; target_type = patch.target_type
+            start_line_index = patch.start_line; end_line_index = patch.end_line
+            self.log_message(f"Snippet identified as {target_type} '{target_name}' (lines {start_line_index + 1}-{end_line_index} of {file_path.name}).", COLOR_INFO)
+            existing_block_lines = patch.original_lines[start_line_index:end_line_index]
+            snippet_lines = patch.snippet_lines
             if not existing_block_lines: print(f"Warning: Extracted empty block for '{target_name}' at lines {start_line_index + 1}-{end_line_index}")
+            if existing_block_lines == snippet_lines: QMessageBox.information(self,"No Changes Detected",f"The provided (cleaned/formatted) snippet seems identical to the existing {target_type} '{target_name}' in the target file."); self.log_message(f"Snippet diff for '{target_name}' showed no changes.", COLOR_INFO); return
             diff_dialog = DiffDialog(existing_block_lines, snippet_lines, fromdesc=f"a/{file_path.name} ({target_name} - Current)", todesc=f"b/{file_path.name} ({target_name} - Snippet)", parent=self)
-            dialog_title = f"Snippet Diff: {target_name} in {file_path.name}"; diff_dialog.setWindowTitle(dialog_title[:120])
-            diff_lines = list(difflib.unified_diff([line + "\n" for line in existing_block_lines], [line + "\n" for line in snippet_lines], lineterm="", n=0))
-            if not diff_lines: QMessageBox.information(self,"No Changes Detected",f"The provided (cleaned/formatted) snippet seems identical to the existing {target_type} '{target_name}' in the target file."); self.log_message(f"Snippet diff for '{target_name}' showed no changes.", COLOR_INFO); return
-            self._pending_patch_info = {"file_path": file_path, "start_line": start_line_index, "end_line": end_line_index, "snippet_lines": snippet_lines, "target_name": target_name, "target_type": target_type}
+            dialog_title = f"Snippet Diff: {target_name} in {file_path.name}"; diff_dialog.setWindowTitle(dialog_title[:DIALOG_TITLE_MAX_LENGTH])
+            self._pending_patch_info = patch
             self.apply_snippet_btn.setEnabled(True)
             self.log_message(f"Snippet diff for '{target_name}' ready. Use 'Apply Snippet' to confirm.", COLOR_INFO)
             diff_dialog.exec()
@@ -1025,27 +1313,29 @@ class App(QWidget):
 
     def apply_snippet_patch(self):
         if not self._pending_patch_info: QMessageBox.warning(self,"No Pending Snippet","Run 'Diff (Snippet)' first to prepare a change."); return
-        file_path = self._pending_patch_info.get("file_path"); start_line = self._pending_patch_info.get("start_line")
-        end_line = self._pending_patch_info.get("end_line"); snippet_lines = self._pending_patch_info.get("snippet_lines")
-        target_name = self._pending_patch_info.get("target_name", "snippet"); target_type = self._pending_patch_info.get("target_type", "block")
-        if file_path is None or start_line is None or end_line is None or snippet_lines is None:
-            QMessageBox.critical(self,"Internal Error","Pending snippet patch information is incomplete or corrupted.")
-            self._clear_and_disable_on_selection_change(); return
+        patch = self._pending_patch_info
+        file_path = patch.file_path; start_line = patch.start_line; end_line = patch.end_line; snippet_lines = patch.snippet_lines
+        target_name = patch.target_name; target_type = patch.target_type
         try:
             backup_ok, backup_err = backup_and_redo(file_path) # Uses central store
             if not backup_ok: error_msg = f"Could not create backup/redo for {file_path.name}: {backup_err}"; self.log_message(error_msg, COLOR_ERROR); QMessageBox.critical(self, "Backup/Redo Error", error_msg); self._clear_and_disable_on_selection_change(); return
-            try:
-                with open(file_path, "r", encoding="utf-8") as f: original_lines_with_ends = f.readlines()
-            except Exception as read_error: QMessageBox.critical(self,"File Read Error",f"Could not read file '{file_path.name}' for patching:\n{read_error}"); self._clear_and_disable_on_selection_change(); return
-            if start_line < 0 or end_line > len(original_lines_with_ends) or start_line > end_line: QMessageBox.critical(self,"Patch Index Error",f"Stored line indices ({start_line + 1}-{end_line}) are invalid for the current state of '{file_path.name}' (Total lines: {len(original_lines_with_ends)}).\nFile may have changed since preview."); self._clear_and_disable_on_selection_change(); return
-            lines_before = original_lines_with_ends[:start_line]
-            snippet_lines_with_os_nl = [line + os.linesep for line in snippet_lines]
-            lines_after = original_lines_with_ends[end_line:]
-            new_content = "".join(lines_before + snippet_lines_with_os_nl + lines_after)
+            original_lines = patch.original_lines; ends_with_newline = patch.ends_with_newline
+            if patch.file_stamp is None or self._preview_key(file_path) != patch.file_stamp:
+                # The file changed since the preview (or couldn't be stat'ed then): read it again
+                original_content, read_error = safe_read_file(file_path)
+                if read_error: QMessageBox.critical(self,"File Read Error",f"Could not read file '{file_path.name}' for patching:\n{read_error}"); self._clear_and_disable_on_selection_change(); return
+                original_lines = split_lines(original_content); ends_with_newline = original_content.endswith(("\n", "\r"))
+            if start_line < 0 or end_line > len(original_lines) or start_line > end_line: QMessageBox.critical(self,"Patch Index Error",f"Stored line indices ({start_line + 1}-{end_line}) are invalid for the current state of '{file_path.name}' (Total lines: {len(original_lines)}).\nFile may have changed since preview."); self._clear_and_disable_on_selection_change(); return
+            lines_after = original_lines[end_line:]
+            # One join; every line keeps its newline except an unterminated last line of the file
+            # (safe_write_file writes in text mode, so "\n" becomes os.linesep on disk)
+            new_content = "\n".join(original_lines[:start_line] + snippet_lines + lines_after)
+            if ends_with_newline or not lines_after: new_content += "\n"
             write_ok, write_err = safe_write_file(file_path, new_content)
             if not write_ok: error_msg = f"Failed to write patch to {file_path.name}: {write_err}"; self.log_message(error_msg, COLOR_ERROR); QMessageBox.critical(self, "File Write Error", error_msg); self._clear_and_disable_on_selection_change(); return
+            self._invalidate_file_caches(file_path)
             self.log_message(f"Applied '{target_name}' {target_type} snippet patch to {file_path.name}.", COLOR_SUCCESS)
-            self._refresh_preview_after_change(file_path)
+            self._refresh_preview_after_change(file_path, new_content)
         except (PermissionError, OSError, shutil.Error) as io_error: error_msg = f"Could not apply patch to {file_path.name}: {io_error}"; self.log_message(error_msg, COLOR_ERROR); QMessageBox.critical(self, "File Operation Error", error_msg)
         except Exception as e: error_msg = f"Failed to apply snippet patch to {file_path.name}: {e}"; self.log_message(error_msg, COLOR_ERROR); traceback.print_exc(); QMessageBox.critical(self, "Apply Patch Error", error_msg)
         finally: self._clear_and_disable_on_selection_change()
@@ -1096,38 +1386,32 @@ class App(QWidget):
             if not os.access(str(central_backup_path), os.R_OK):
                 raise PermissionError(f"Cannot read central backup file: {central_backup_path}")
 
-            # Check write permission for ORIGINAL target (or its directory)
-            can_write_target = (original_file_path.exists() and os.access(str(original_file_path), os.W_OK)) or \
-                               (not original_file_path.exists() and os.access(str(original_file_path.parent), os.W_OK))
+            # Check write permission for ORIGINAL target (or its directory) up front: the backups are
+            # rotated before the target is written, so a late failure would leave them out of step
+            target_exists = probe_path(original_file_path)[0] is not None  # One stat, reused below
+            can_write_target = os.access(str(original_file_path), os.W_OK) if target_exists else os.access(str(original_file_path.parent), os.W_OK)
             if not can_write_target:
-                perm_issue = f"writing to file {original_file_path.name}" if original_file_path.exists() else f"writing to directory {original_file_path.parent}"
+                perm_issue = f"writing to file {original_file_path.name}" if target_exists else f"writing to directory {original_file_path.parent}"
                 raise PermissionError(f"Permission denied {perm_issue}")
 
-            # --- Save Current State for Redo (Centrally) ---
-            # Use backup_and_redo utility: it saves current ORIGINAL file state to CENTRAL .redo
-            # and moves existing CENTRAL .redo to CENTRAL .bak
-            redo_ok, redo_err = backup_and_redo(original_file_path)
-            if not redo_ok:
-                raise OSError(f"Could not save current state for central redo: {redo_err}")
+            def undo_files():
+                # --- Save Current State for Redo (Centrally) ---
+                # Use backup_and_redo utility: it saves current ORIGINAL file state to CENTRAL .redo
+                # and moves existing CENTRAL .redo to CENTRAL .bak
+                redo_ok, redo_err = backup_and_redo(original_file_path)
+                if not redo_ok:
+                    raise OSError(f"Could not save current state for central redo: {redo_err}")
 
-            # --- Perform Undo (Restore from CENTRAL Backup to ORIGINAL file) ---
-            shutil.copy2(str(central_backup_path), str(original_file_path))
+                # --- Perform Undo (Restore from CENTRAL Backup to ORIGINAL file) ---
+                fast_copy(central_backup_path, original_file_path)
 
-            self.log_message(f"Undo: Restored '{original_file_path.name}' from central backup.", COLOR_SUCCESS)
-
-            # --- Post Undo ---
-            self._refresh_preview_after_change(original_file_path)
-            self._clear_and_disable_on_selection_change()
+            self._start_file_op(undo_files, lambda error: self._finish_undo_redo("Undo", original_file_path, error))
 
         except (PermissionError, OSError, shutil.Error) as io_error:
-            error_msg = f"Undo Error: {io_error}"
-            self.log_message(error_msg, COLOR_ERROR)
-            QMessageBox.critical(self, "File Operation Error", error_msg)
+            self._finish_undo_redo("Undo", original_file_path, io_error)
         except Exception as e:
-            error_msg = f"Failed to perform undo for {original_file_path.name}: {e}"
-            self.log_message(error_msg, COLOR_ERROR)
             traceback.print_exc()
-            QMessageBox.critical(self, "Undo Error", error_msg)
+            self._finish_undo_redo("Undo", original_file_path, e)
 
     def redo_change(self):
         """Restores the selected file from its CENTRAL .redo file (if exists)."""
@@ -1153,53 +1437,73 @@ class App(QWidget):
             if not os.access(str(central_redo_path), os.R_OK):
                 raise PermissionError(f"Cannot read central redo file: {central_redo_path}")
 
-            # Check write permission for ORIGINAL target (or its directory)
-            can_write_target = (original_file_path.exists() and os.access(str(original_file_path), os.W_OK)) or \
-                               (not original_file_path.exists() and os.access(str(original_file_path.parent), os.W_OK))
+            # Check write permission for ORIGINAL target (or its directory) up front: the backups are
+            # rotated before the target is written, so a late failure would leave them out of step
+            target_exists = probe_path(original_file_path)[0] is not None  # One stat, reused below
+            can_write_target = os.access(str(original_file_path), os.W_OK) if target_exists else os.access(str(original_file_path.parent), os.W_OK)
             if not can_write_target:
-                perm_issue = f"writing to file {original_file_path.name}" if original_file_path.exists() else f"writing to directory {original_file_path.parent}"
+                perm_issue = f"writing to file {original_file_path.name}" if target_exists else f"writing to directory {original_file_path.parent}"
                 raise PermissionError(f"Permission denied {perm_issue}")
 
-            # --- Save Current State for Undo (Back to CENTRAL Backup) ---
-            # Before restoring from .redo, save the *current* ORIGINAL state back to the
-            # CENTRAL .bak file. This allows undoing the redo.
-            if original_file_path.exists():
-                # Need central backup path again
-                _cbd, cbp, _crp, p_err = get_central_backup_paths(original_file_path)
-                if p_err or not cbp:
-                     print(f"Warning: Cannot determine central backup path before redo for {original_file_path.name}. Undo may fail.")
-                else:
-                     # Ensure central backup directory exists
-                     cbp.parent.mkdir(parents=True, exist_ok=True)
-                     # Check permissions
-                     can_read_target = os.access(str(original_file_path), os.R_OK)
-                     can_write_bak_dir = os.access(str(cbp.parent), os.W_OK)
-                     if not can_read_target:
-                         print(f"Warning: Cannot read current file {original_file_path.name} to update central backup before redo.")
-                     elif not can_write_bak_dir:
-                         print(f"Warning: Cannot write central backup file in {cbp.parent} before redo (permission denied).")
-                     else:
-                         # Create CENTRAL backup from current state (overwrites existing central .bak)
-                         shutil.copy2(str(original_file_path), str(cbp))
-
-            # --- Perform Redo (Restore from CENTRAL Redo State to ORIGINAL File) ---
-            shutil.copy2(str(central_redo_path), str(original_file_path))
-
-            self.log_message(f"Redo: Restored '{original_file_path.name}' from central redo state.", COLOR_SUCCESS)
-
-            # --- Post Redo ---
-            self._refresh_preview_after_change(original_file_path)
-            self._clear_and_disable_on_selection_change()
+            def redo_files():
+                # --- Save Current State for Undo (Back to CENTRAL Backup) ---
+                # Before restoring from .redo, save the *current* ORIGINAL state back to the
+                # CENTRAL .bak file. This allows undoing the redo.
+                if target_exists:
+                    # Create CENTRAL backup from current state (overwrites existing central .bak).
+                    # No access() probes: fast_copy opens the source before truncating the backup,
+                    # so a permission problem leaves the old .bak in place.
+                    try:
+                        fast_copy(original_file_path, central_backup_path)
+                    except PermissionError as e:
+                        print(f"Warning: Cannot update central backup for {original_file_path.name} before redo (permission denied): {e}")
+
+                # --- Perform Redo (Restore from CENTRAL Redo State to ORIGINAL File) ---
+                fast_copy(central_redo_path, original_file_path)
+
+            self._start_file_op(redo_files, lambda error: self._finish_undo_redo("Redo", original_file_path, error))
 
         except (PermissionError, OSError, shutil.Error) as io_error:
-            error_msg = f"Redo Error: {io_error}"
+            self._finish_undo_redo("Redo", original_file_path, io_error)
+        except Exception as e:
+            traceback.print_exc()
+            self._finish_undo_redo("Redo", original_file_path, e)
+
+    def _start_file_op(self, operation, on_done) -> bool:
+        """
+        Runs operation() (the file copies of an undo/redo) on the thread pool and calls
+        on_done(error) back on the GUI thread; error is None on success.
+        Undo/Redo stay disabled while it runs. Returns False if an operation is already running.
+        """
+        if self._file_op_worker is not None: self.log_message("A file operation is already in progress, please wait.", COLOR_WARNING); return False
+        worker = FileOpWorker(operation)
+        def finished(error: Exception | None):
+            self._file_op_worker = None; self.undo_btn.setEnabled(True); self.redo_btn.setEnabled(True)
+            on_done(error)
+        worker.signals.finished.connect(finished)
+        self._file_op_worker = worker # Keeps the worker and its signals object alive until delivery
+        self.undo_btn.setEnabled(False); self.redo_btn.setEnabled(False)
+        QThreadPool.globalInstance().start(worker)
+        return True
+
+    def _finish_undo_redo(self, action: str, original_file_path: Path, error: Exception | None):
+        """Reports an undo/redo (action is "Undo" or "Redo") and refreshes the UI after it."""
+        if error is None:
+            self._invalidate_file_caches(original_file_path)
+            source = "central backup" if action == "Undo" else "central redo state"
+            self.log_message(f"{action}: Restored '{original_file_path.name}' from {source}.", COLOR_SUCCESS)
+
+            # --- Post Undo/Redo ---
+            self._refresh_preview_after_change(original_file_path)
+            self._clear_and_disable_on_selection_change()
+        elif isinstance(error, (PermissionError, OSError, shutil.Error)):
+            error_msg = f"{action} Error: {error}"
             self.log_message(error_msg, COLOR_ERROR)
             QMessageBox.critical(self, "File Operation Error", error_msg)
-        except Exception as e:
-            error_msg = f"Failed to perform redo for {original_file_path.name}: {e}"
+        else:
+            error_msg = f"Failed to perform {action.lower()} for {original_file_path.name}: {error}"
             self.log_message(error_msg, COLOR_ERROR)
-            traceback.print_exc()
-            QMessageBox.critical(self, "Redo Error", error_msg)
+            QMessageBox.critical(self, f"{action} Error", error_msg)
 
 
     # --- Editor Find Functionality ---
@@ -1210,16 +1514,14 @@ class App(QWidget):
         self.find_bar_input.setFocus(); self.find_bar_input.selectAll()
 
     def _get_find_flags(self, backward: bool = False) -> QTextDocument.FindFlag:
-        flags = QTextDocument.FindFlag(0)
-        if self.find_bar_case_checkbox.isChecked(): flags |= QTextDocument.FindFlag.FindCaseSensitively
-        if backward: flags |= QTextDocument.FindFlag.FindBackward
-        return flags
+        return self._FIND_FLAGS[(self.find_bar_case_checkbox.isChecked(), backward)]
 
     def _do_find_in_editor(self, backward: bool = False):
         search_text = self.find_bar_input.text(); editor = self.new_code_editor
-        if not search_text: self.find_bar_input.setPalette(editor.palette()); return False
+        if not search_text: self._reset_find_bar_palette(); return False
         flags = self._get_find_flags(backward=backward)
         found = editor.find(search_text, flags)
+        self._find_bar_highlighted = True
         if found: self.find_bar_input.setPalette(self._find_match_palette_match)
         else:
             self.find_bar_input.setPalette(self._find_match_palette_no_match)
@@ -1236,42 +1538,61 @@ class App(QWidget):
     def find_previous_in_editor(self): self._do_find_in_editor(backward=True)
 
     def _on_find_bar_text_changed(self, text: str):
-        current_base_color = self.find_bar_input.palette().color(QPalette.ColorRole.Base)
-        default_base_color = self.new_code_editor.palette().color(QPalette.ColorRole.Base)
-        if current_base_color != default_base_color: self.find_bar_input.setPalette(self.new_code_editor.palette())
+        # Runs on every keystroke: only touch the palette if a search result is still shown
+        if self._find_bar_highlighted: self._reset_find_bar_palette()
+
+    def _reset_find_bar_palette(self):
+        if not self._find_bar_highlighted: return
+        # The editor's palette is fixed once the style sheet is applied; fetch it on first use (after polish), then reuse it
+        if self._editor_palette is None: self._editor_palette = self.new_code_editor.palette()
+        self.find_bar_input.setPalette(self._editor_palette); self._find_bar_highlighted = False
 
 
     # --- Graceful Shutdown ---
-    # closeEvent, _check_threads_before_close remain IDENTICAL
+    # A close while background work runs is deferred: the work is cancelled and the window closes
+    # from the threads' finished signals (_maybe_finalize_close). Only if they haven't stopped after
+    # CLOSE_FORCE_PROMPT_MS is the user offered a force quit (_ask_force_quit).
+
+    def _running_background_tasks(self) -> list[str]:
+        thread_names = []
+        if self.scan_thread and self.scan_thread.isRunning(): thread_names.append("File Scan")
+        if self.replace_thread and self.replace_thread.isRunning(): thread_names.append("File Processing")
+        return thread_names
 
     def closeEvent(self, event):
         print("Close event triggered.")
-        self.cancel_operation()
-        scan_running = self.scan_thread and self.scan_thread.isRunning()
-        replace_running = self.replace_thread and self.replace_thread.isRunning()
-        if scan_running or replace_running:
-            print("Background operations active. Waiting briefly before re-checking...")
-            QTimer.singleShot(300, lambda: self._check_threads_before_close(event))
+        if self._force_close: print("Forcing close."); event.accept(); return
+        if not self._close_pending: self.cancel_operation()
+        if self._running_background_tasks():
+            if not self._close_pending:
+                print("Background operations active. Closing once they stop...")
+                self._close_pending = True
+                QTimer.singleShot(CLOSE_FORCE_PROMPT_MS, self._ask_force_quit)
             event.ignore()
         else:
             print("No background operations running. Closing application.")
             event.accept()
 
-    def _check_threads_before_close(self, event):
-        print("Re-checking thread status before close...")
-        scan_running = self.scan_thread and self.scan_thread.isRunning()
-        replace_running = self.replace_thread and self.replace_thread.isRunning()
-        if scan_running or replace_running:
-            thread_names = []
-            if scan_running: thread_names.append("File Scan")
-            if replace_running: thread_names.append("File Processing")
-            running_tasks = " and ".join(thread_names)
-            reply = QMessageBox.warning(self,"Operations Still Running",f"The following background task(s) did not stop quickly:\n- {running_tasks}\n\nForcing quit might leave files in an inconsistent state.\n\nForce quit anyway?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
-            if reply == QMessageBox.StandardButton.Yes: print("User chose to force quit. Accepting close event."); event.accept()
-            else:
-                print("User cancelled close. Allowing operations to continue.")
-                event.ignore()
-                if hasattr(self, "cancel_btn"): self.cancel_btn.setEnabled(True)
+    def _maybe_finalize_close(self):
+        """Connected to the background threads' finished signals; completes a deferred close."""
+        if not self._close_pending: return
+        for thread in (self.scan_thread, self.replace_thread):
+            # ReplacementThread emits its own finished signal as the last step of run(); let run() return
+            if thread and thread.isRunning(): thread.wait(500)
+        if self._running_background_tasks(): return
+        print("Background operations finished. Closing application.")
+        self._close_pending = False
+        self.close()
+
+    def _ask_force_quit(self):
+        if not self._close_pending: return
+        thread_names = self._running_background_tasks()
+        if not thread_names: self._maybe_finalize_close(); return
+        running_tasks = " and ".join(thread_names)
+        reply = QMessageBox.warning(self,"Operations Still Running",f"The following background task(s) did not stop quickly:\n- {running_tasks}\n\nForcing quit might leave files in an inconsistent state.\n\nForce quit anyway?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No, QMessageBox.StandardButton.No)
+        if not self._close_pending: return # The threads finished (and the window closed) while the question was open
+        self._close_pending = False
+        if reply == QMessageBox.StandardButton.Yes: print("User chose to force quit."); self._force_close = True; self.close()
         else:
-            print("Background operations finished. Closing application.")
-            event.accept()
\ No newline at end of file
+            print("User cancelled close. Allowing operations to continue.")
+            if hasattr(self, "cancel_btn"): self.cancel_btn.setEnabled(True)
\ No newline at end of file
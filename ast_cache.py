@@ -0,0 +1,154 @@
+# --- ast_cache.py ---
+"""
+SQLite-backed cache of parsed target files, keyed by file path and the SHA-256
+of the source text. What gets stored is the compact definition index from
+ast_utils.collect_definition_spans (name -> line span), marshalled. Snippet
+diffs only need a definition's line span, and loading the index is far cheaper
+than unpickling a full tree, which costs about as much as ast.parse.
+The cache file lives in ~/.code_helper/ast_cache.sqlite. If it can't be opened,
+every call falls back to a plain parse.
+The most recently used indexes are also kept in memory, one per file, keyed by
+the same hash, so repeated snippet previews against an unchanged file skip SQLite.
+"""
+
+import ast
+import hashlib
+import marshal
+import sqlite3
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+
+from constants import CODE_HELPER_DATA_DIR_NAME, AST_CACHE_FILE_NAME, AST_MEMORY_CACHE_SIZE
+from ast_utils import collect_definition_spans, span_to_line_range
+
+# Line numbers (e.g. end_lineno handling) can differ between interpreter versions
+# The index format version (bump when collect_definition_spans changes) is part of it too
+_PY_VERSION = f"{sys.version_info.major}.{sys.version_info.minor}/2"
+
+_connection: sqlite3.Connection | None = None
+_connection_failed = False
+_connection_lock = threading.Lock() # Guards the connection: lookups also run on thread pool workers (snippet previews)
+_memory: OrderedDict[str, tuple[str, dict]] = OrderedDict() # Resolved path -> (source SHA-256, definition index), LRU
+_memory_lock = threading.Lock()
+
+def _get_connection() -> sqlite3.Connection | None:
+    """Opens (once) the cache database, or returns None if it is unavailable."""
+    global _connection, _connection_failed
+    if _connection is not None or _connection_failed:
+        return _connection
+    try:
+        db_dir = Path.home() / CODE_HELPER_DATA_DIR_NAME
+        db_dir.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(db_dir / AST_CACHE_FILE_NAME), check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS ast_cache ("
+            "path TEXT PRIMARY KEY, sha TEXT NOT NULL, py_version TEXT NOT NULL, blob BLOB NOT NULL)"
+        )
+        connection.commit()
+        _connection = connection
+    except (sqlite3.Error, OSError) as e:
+        print(f"Warning: AST cache disabled, could not open database: {e}")
+        _connection_failed = True
+    return _connection
+
+def get_definition_spans(file_path: Path, source: str) -> dict[str, tuple[int, int | None, str]]:
+    """
+    Returns the definition index for `source`, the current content of `file_path`.
+
+    Raises:
+        SyntaxError: If the source can't be parsed (nothing is cached in that case).
+    """
+    key = str(file_path.resolve())
+    # Keyed by content, not the file's stat: the file may change between the caller's read and now
+    sha = hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+    with _memory_lock:
+        cached = _memory.get(key)
+        if cached is not None and cached[0] == sha:
+            _memory.move_to_end(key)
+            return cached[1]
+
+    spans = _load_definition_spans(file_path, key, source, sha)
+    with _memory_lock:
+        _memory[key] = (sha, spans)
+        _memory.move_to_end(key)
+        while len(_memory) > AST_MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+    return spans
+
+def _load_definition_spans(file_path: Path, key: str, source: str, sha: str) -> dict[str, tuple[int, int | None, str]]:
+    """Reads the index for `source` (whose SHA-256 is `sha`) from the database, or parses and stores it."""
+    with _connection_lock:
+        connection = _get_connection()
+    if connection is None:
+        return collect_definition_spans(ast.parse(source))
+
+    try:
+        with _connection_lock:
+            row = connection.execute(
+                "SELECT blob FROM ast_cache WHERE path=? AND sha=? AND py_version=?", (key, sha, _PY_VERSION)
+            ).fetchone()
+        if row is not None:
+            return marshal.loads(row[0])
+    except (sqlite3.Error, ValueError, EOFError, TypeError) as e:
+        print(f"Warning: AST cache read failed for {file_path.name}: {e}")
+
+    spans = collect_definition_spans(ast.parse(source))
+    try:
+        with _connection_lock:
+            connection.execute(
+                "INSERT OR REPLACE INTO ast_cache (path, sha, py_version, blob) VALUES (?, ?, ?, ?)",
+                (key, sha, _PY_VERSION, marshal.dumps(spans)),
+            )
+            connection.commit()
+    except sqlite3.Error as e:
+        print(f"Warning: AST cache write failed for {file_path.name}: {e}")
+    return spans
+
+def invalidate(file_path: Path):
+    """Drops the cached entry for `file_path` (call after the app writes the file)."""
+    with _memory_lock:
+        _memory.pop(str(file_path.resolve()), None)
+    with _connection_lock:
+        connection = _get_connection()
+    if connection is None:
+        return
+    try:
+        with _connection_lock:
+            connection.execute("DELETE FROM ast_cache WHERE path=?", (str(file_path.resolve()),))
+            connection.commit()
+    except sqlite3.Error as e:
+        print(f"Warning: AST cache invalidation failed for {file_path.name}: {e}")
+
+def find_ast_node_in_file(file_path: Path, source: str, target_name: str) -> tuple[tuple[int, int | None, str] | None, str | None]:
+    """
+    Finds the first function or class definition named `target_name` (top-level
+    definitions first, then nested ones in source order) in the content of a file on disk.
+
+    Args:
+        file_path: The file `source` was read from (the cache key).
+        source: The current content of the file.
+        target_name: The name of the function or class to find.
+
+    Returns:
+        A tuple containing:
+        - The first matching definition's line range as (start_line_index, end_line_index, node type name),
+          or None if not found or if a parsing error occurred.
+        - An error message string if parsing failed, otherwise None.
+    """
+    try:
+        span = get_definition_spans(file_path, source).get(target_name)
+        return (span_to_line_range(span) if span else None), None
+    except SyntaxError as e:
+        error_message = f"AST Parsing Syntax Error: {e}"
+        print(error_message)
+        return None, error_message
+    except Exception as e:
+        error_message = f"Unexpected AST processing error: {e}"
+        print(error_message)
+        traceback.print_exc()
+        return None, error_message
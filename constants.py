@@ -11,15 +11,38 @@ APP_VERSION = "0.7.0" # Increment version (significant change)
 DEFAULT_WINDOW_WIDTH = 1200
 DEFAULT_WINDOW_HEIGHT = 850
 LOG_AREA_HEIGHT = 100
+LOG_MAX_BLOCKS = 5000 # Log area keeps only the most recent lines
+LOG_DIFF_MAX_LINES = 200 # Per-file diff lines shown in the log after Scan & Run updates a file
+LOG_FLUSH_INTERVAL_MS = 50 # Queued log messages are written to the log area in batches at this interval
 DEFAULT_FONT_SIZE = 10
 FALLBACK_FONT_FAMILY = "Courier New" if platform.system() == "Windows" else "Monospace"
 FONT_FILENAME = "JetBrainsMono-Regular.ttf" # Expected in root or resources
 ICON_FILENAME = "Code_Helper.ico" # Expected in root or resources
 DEFAULT_SPLITTER_MAIN_SIZES = [250, 750] # Initial sizes for Tree | Editors splitter
 DEFAULT_SPLITTER_RIGHT_SIZES = [400, 350] # Initial sizes for Preview | New Code splitter
+DIALOG_TITLE_MAX_LENGTH = 120 # Diff dialog titles (which include file/definition names) are cut to this length
 # RUFF_TIMEOUT = 5.0 # Timeout for Ruff subprocess calls in seconds - REMOVED
-BLACK_TIMEOUT = 5.0 # Timeout for Black subprocess calls in seconds
+BLACK_TIMEOUT = 5.0 # Timeout for Black subprocess calls in seconds (only used when Black can't be imported)
+FORMAT_CACHE_SIZE = 64 # Successful Black results kept in memory, keyed by input text
 CODE_HELPER_BACKUP_DIR_NAME = ".code_helper_backups" # ADDED: Central backup dir name
+CODE_HELPER_DATA_DIR_NAME = ".code_helper" # Per-user app data (caches) under the home directory
+AST_CACHE_FILE_NAME = "ast_cache.sqlite" # Parsed-AST cache inside CODE_HELPER_DATA_DIR_NAME
+AST_MEMORY_CACHE_SIZE = 32 # Definition indexes kept in memory (one per file), on top of the SQLite cache
+DEBUG_ENV_VAR = "CODE_HELPER_DEBUG" # Set (e.g. to 1) to write startup diagnostics to DEBUG_LOG_FILE_NAME
+DEBUG_LOG_FILE_NAME = "debug.log" # Startup debug log inside CODE_HELPER_DATA_DIR_NAME (rotated)
+DEBUG_LOG_MAX_BYTES = 1024 * 1024 # Size at which the debug log is rotated
+DEBUG_LOG_BACKUP_COUNT = 3 # Rotated debug logs kept
+HIGHLIGHT_INITIAL_BLOCKS = 300 # Lines highlighted immediately when a large text is loaded into an editor
+HIGHLIGHT_CHUNK_BLOCKS = 1000 # Lines highlighted per idle step for the rest of a large text
+HIGHLIGHT_CACHE_LINES = 4096 # Distinct lines whose syntax highlighting is memoized (see PythonHighlighter._compute_spans)
+FILTER_DEBOUNCE_MS = 200 # Delay after the last keystroke before the file tree filter is applied
+PREVIEW_DEBOUNCE_MS = 120 # Delay after the last tree click before the file is loaded into the preview
+PREVIEW_MAX_FILE_BYTES = 2 * 1024 * 1024 # Larger files are only partially shown in the preview
+PREVIEW_TRUNCATED_BYTES = 256 * 1024 # How much of a larger file the preview shows
+REPLACEMENT_POOL_SIZE = 0 # Worker processes for Scan & Run; 0 = one per CPU core minus one
+PROGRESS_BATCH_SIZE = 32 # Scan & Run results relayed to the UI per progress signal, at most
+PROGRESS_BATCH_INTERVAL_MS = 50 # ... and a finished file waits at most this long after the previous emit
+CLOSE_FORCE_PROMPT_MS = 2000 # On close, how long to wait for cancelled background work before offering to force quit
 
 # --- Style & Colors (Dark Theme) ---
 COLOR_BACKGROUND = "#1e1e1e"
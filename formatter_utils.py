@@ -4,10 +4,24 @@ import subprocess
 import sys
 import traceback
 import os
+import re
+import hashlib
+import threading
 import textwrap # Added for indentation normalization
+from collections import OrderedDict
 
 # Import constants from the constants module (Direct Import)
-from constants import BLACK_TIMEOUT # Use BLACK_TIMEOUT now
+from constants import BLACK_TIMEOUT, FORMAT_CACHE_SIZE # Use BLACK_TIMEOUT now
+
+# Non-ASCII characters from chat pastes and their ASCII replacements. One str.replace per
+# character is much faster than str.translate (which looks up every character of a non-ASCII
+# string in the table) or a regex sub with a callback: each replace is a C-level search and
+# returns the string itself, without copying, when the character doesn't occur.
+_CHAT_PASTE_REPLACEMENTS = (
+    ('\xa0', ' '), # Non-breaking space
+    ('“', '"'), ('”', '"'), # "Smart" double quotes
+    ("‘", "'"), ("’", "'"), # "Smart" single quotes
+)
 
 def clean_chat_paste(code_string: str) -> str:
     """
@@ -28,15 +42,18 @@ def clean_chat_paste(code_string: str) -> str:
         return ""
 
     try:
-        # Replace non-breaking space (U+00A0) with standard space
-        cleaned = code_string.replace('\xa0', ' ')
+        # Typed/already-clean code (the usual case) has nothing to replace: isascii() only reads
+        # the string's ASCII flag, and the CR check is a single C-level scan
+        if code_string.isascii() and "\r" not in code_string:
+            return code_string.strip()
 
-        # Replace common "smart" quotes with standard ASCII quotes
-        cleaned = cleaned.replace('“', '"').replace('”', '"') # Double quotes
-        cleaned = cleaned.replace("‘", "'").replace("’", "'") # Single quotes
+        # Normalize line endings (CR LF -> LF, then lone CR -> LF)
+        cleaned = code_string.replace('\r\n', '\n').replace('\r', '\n')
 
-        # Normalize line endings: CR LF -> LF, CR -> LF
-        cleaned = cleaned.replace('\r\n', '\n').replace('\r', '\n')
+        # Replace non-breaking spaces and "smart" quotes with their ASCII counterparts
+        if not cleaned.isascii():
+            for char, replacement in _CHAT_PASTE_REPLACEMENTS:
+                cleaned = cleaned.replace(char, replacement)
 
         # Strip leading/trailing whitespace from the entire block
         cleaned = cleaned.strip()
@@ -48,6 +65,9 @@ def clean_chat_paste(code_string: str) -> str:
         return code_string
 
 
+# textwrap.dedent blanks whitespace-only lines before measuring the common margin; same pattern
+_WHITESPACE_ONLY_LINE_RE = re.compile(r"^[ \t]+$", re.MULTILINE)
+
 def normalize_indentation(code_string: str, indent_width: int = 4) -> str:
     """
     Normalizes indentation in a code block:
@@ -65,12 +85,17 @@ def normalize_indentation(code_string: str, indent_width: int = 4) -> str:
         return ""
 
     try:
-        # Dedent removes common leading whitespace from all lines
-        # It's quite robust against mixed tabs/spaces in the leading indent
-        dedented_code = textwrap.dedent(code_string)
+        if code_string and code_string[0] not in " \t\n":
+            # The first line isn't indented, so there is no common margin to measure or remove
+            # (the usual case, as clean_chat_paste strips the text); only blank whitespace-only lines like dedent
+            dedented_code = _WHITESPACE_ONLY_LINE_RE.sub("", code_string)
+        else:
+            # Dedent removes common leading whitespace from all lines
+            # It's quite robust against mixed tabs/spaces in the leading indent
+            dedented_code = textwrap.dedent(code_string)
 
         # Replace any remaining tabs with the specified number of spaces
-        space_normalized_code = dedented_code.replace("\t", " " * indent_width)
+        space_normalized_code = dedented_code.replace("\t", " " * indent_width) if "\t" in dedented_code else dedented_code
 
         return space_normalized_code
     except Exception as e:
@@ -78,7 +103,97 @@ def normalize_indentation(code_string: str, indent_width: int = 4) -> str:
         # Return the original string if normalization fails
         return code_string
 
+# --- In-Process Black ---
+# Black is a library: calling black.format_str directly avoids starting a Python
+# interpreter (and importing Black) for every format. The import is deferred to the
+# first format so app startup doesn't pay for it; without Black installed in this
+# environment, formatting falls back to running `python -m black` as a subprocess.
+_black = None
+_black_mode = None # black.Mode from the pyproject.toml `python -m black` would use, read with the import
+_black_import_failed = False
+_black_import_lock = threading.Lock()
+
+def _get_black():
+    """Imports black once (thread-safe); returns the module, or None if it isn't importable."""
+    global _black, _black_mode, _black_import_failed
+    if _black is not None or _black_import_failed:
+        return _black
+    with _black_import_lock:
+        if _black is None and not _black_import_failed:
+            try:
+                import black
+                _black_mode = _read_black_mode(black)
+                _black = black
+            except ImportError as e:
+                print(f"Black library not importable ({e}); formatting will run 'python -m black' instead.")
+                _black_import_failed = True
+    return _black
+
+def _read_black_mode(black):
+    """
+    Builds the black.Mode for the [tool.black] settings the command line tool would pick up
+    from the working directory (line-length, target-version, string/trailing comma options,
+    preview), or Black's defaults if there is no config file.
+    """
+    try:
+        config_path = black.find_pyproject_toml((os.getcwd(),))
+        if not config_path:
+            return black.Mode()
+        config = black.parse_pyproject_toml(config_path)
+        return black.Mode(
+            target_versions={black.TargetVersion[version.upper()] for version in config.get("target_version", ())},
+            line_length=config.get("line_length", black.DEFAULT_LINE_LENGTH),
+            string_normalization=not config.get("skip_string_normalization", False),
+            magic_trailing_comma=not config.get("skip_magic_trailing_comma", False),
+            preview=config.get("preview", False),
+        )
+    except Exception as e:
+        print(f"Warning: Could not read Black settings from pyproject.toml ({e}); using Black's defaults.")
+        return black.Mode()
+
+# Windows specific flags to prevent console window popup, for the subprocess fallback
+# (subprocess copies the STARTUPINFO on each call, so one instance can be shared)
+_SUBPROCESS_WINDOW_KWARGS: dict = {}
+if os.name == "nt":
+    _startupinfo = subprocess.STARTUPINFO()
+    _startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    _SUBPROCESS_WINDOW_KWARGS = {"startupinfo": _startupinfo, "creationflags": subprocess.CREATE_NO_WINDOW}
+
+# --- Format Result Cache ---
+# Successful results keyed by a digest of the input, so repeated Format/Diff/Apply
+# clicks on unchanged editor text don't start another Black subprocess.
+# Failures (syntax errors, timeouts, missing Black) are never cached.
+_format_cache: OrderedDict[bytes, str] = OrderedDict()
+_format_cache_lock = threading.Lock() # Formatting runs on worker threads
+
+def _format_cache_key(code_string: str) -> bytes:
+    return hashlib.blake2b(code_string.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
 def preprocess_and_format_with_black(code_string: str) -> tuple[str, str | None]:
+    """
+    Cached front end for `_preprocess_and_format_with_black`; same arguments and results.
+    """
+    if not isinstance(code_string, str):
+        return _preprocess_and_format_with_black(code_string)
+    key = _format_cache_key(code_string)
+    with _format_cache_lock:
+        cached = _format_cache.get(key)
+        if cached is not None:
+            _format_cache.move_to_end(key)
+            return cached, None
+    formatted_code, error_message = _preprocess_and_format_with_black(code_string)
+    if error_message is None:
+        with _format_cache_lock:
+            _format_cache[key] = formatted_code
+            # The output is usually fed back in (Format, then Diff/Apply on the editor text). Black's output is
+            # stable, so when preprocessing leaves it unchanged (apart from the final newline) it maps to itself.
+            if normalize_indentation(clean_chat_paste(formatted_code)) in (formatted_code, formatted_code[:-1]):
+                _format_cache[_format_cache_key(formatted_code)] = formatted_code
+            while len(_format_cache) > FORMAT_CACHE_SIZE:
+                _format_cache.popitem(last=False)
+    return formatted_code, error_message
+
+def _preprocess_and_format_with_black(code_string: str) -> tuple[str, str | None]:
     """
     Preprocesses and formats a Python code string using Black.
 
@@ -87,7 +202,8 @@ def preprocess_and_format_with_black(code_string: str) -> tuple[str, str | None]
     2. `normalize_indentation`: Dedents and converts tabs to spaces.
 
     Formatting step:
-    - Uses the 'black' command-line tool via subprocess.
+    - Uses black.format_str in-process (with the [tool.black] settings the CLI would use), or the 'black'
+      command-line tool via subprocess if the library can't be imported.
 
     Args:
         code_string: The raw Python code to preprocess and format.
@@ -129,17 +245,24 @@ def preprocess_and_format_with_black(code_string: str) -> tuple[str, str | None]
         return processed_code, None # Return empty string, no error
 
     # --- Step 3: Run Black Formatter ---
+    black = _get_black()
+    if black is not None:
+        try:
+            return black.format_str(processed_code, mode=_black_mode), None
+        except black.InvalidInput as e:
+            error_message = f"Black formatting failed:\n{e}" # Usually a syntax error in the code
+            print(error_message)
+            # Return the *preprocessed* code when Black fails, along with the error
+            return processed_code, error_message
+        except Exception as e:
+            error_message = f"An unexpected error occurred while running Black: {e}"
+            print(error_message)
+            traceback.print_exc()
+            return processed_code, error_message
+
     try:
         command = [sys.executable, "-m", "black", "-", "--quiet"]
 
-        # Windows specific flags to prevent console window popup
-        startupinfo = None
-        creationflags = 0
-        if os.name == "nt":
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            creationflags = subprocess.CREATE_NO_WINDOW
-
         process = subprocess.run(
             command,
             input=processed_code, # Pass the preprocessed code to Black
@@ -148,8 +271,7 @@ def preprocess_and_format_with_black(code_string: str) -> tuple[str, str | None]
             check=False, # Don't raise exception on non-zero exit code, handle manually
             encoding="utf-8",
             timeout=BLACK_TIMEOUT,
-            startupinfo=startupinfo,
-            creationflags=creationflags,
+            **_SUBPROCESS_WINDOW_KWARGS,
         )
 
         # Check Black's exit code
@@ -1,20 +1,41 @@
 
 
 import re
+from functools import lru_cache
 from PyQt6.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont
+from PyQt6.QtCore import QTimer
 # Use direct import for flat structure
 from constants import COLOR_DIFF_ADDED_BG, COLOR_DIFF_REMOVED_BG # Import colors
+from constants import HIGHLIGHT_INITIAL_BLOCKS, HIGHLIGHT_CHUNK_BLOCKS, HIGHLIGHT_CACHE_LINES
+
+# Block state for lines whose highlighting has been deferred (see prepare_for_bulk_text)
+_STATE_PENDING = -2
 
 class PythonHighlighter(QSyntaxHighlighter):
     """
     A syntax highlighter for Python code, designed for dark themes.
     Handles keywords, builtins, numbers, strings (including multiline),
     comments, decorators, function/class names, and self/cls.
+
+    Large documents loaded in one go are highlighted incrementally: the first
+    screenful right away, the rest in chunks from an idle timer.
     """
+    _rules_built = False
+
     def __init__(self, document):
         super().__init__(document)
-        self.highlightingRules = []
-
+        self._highlight_limit: int | None = None # Blocks at/after this number are deferred
+        self._chunk_timer = QTimer(self)
+        self._chunk_timer.setSingleShot(True)
+        self._chunk_timer.setInterval(0)
+        self._chunk_timer.timeout.connect(self._highlight_next_chunk)
+
+        # Formats and patterns don't depend on the document: built once, shared by all instances
+        if not PythonHighlighter._rules_built: PythonHighlighter._build_rules()
+
+    @classmethod
+    def _build_rules(cls):
+        """Creates the text formats and compiled patterns as class attributes (on first use, so no Qt objects are made at import)."""
         # --- Text Format Definitions ---
         # Keyword format (e.g., def, class, if, for)
         keywordFormat = QTextCharFormat()
@@ -52,6 +73,10 @@ class PythonHighlighter(QSyntaxHighlighter):
         selfFormat.setForeground(QColor("#9CDCFE")) # Light blue
 
         # --- Regex Rules ---
+        # All single-line rules are alternatives of one master pattern, so highlightBlock scans each
+        # line once. At every position the first alternative that matches wins and its match is
+        # consumed: comments and strings take their whole content (keywords, numbers or quotes
+        # inside them aren't colored separately), and "def name" beats the plain keyword.
         # Keywords
         keywords = [
             "and", "as", "assert", "async", "await", "break", "class", "continue",
@@ -59,9 +84,6 @@ class PythonHighlighter(QSyntaxHighlighter):
             "global", "if", "import", "in", "is", "lambda", "None", "nonlocal", "not",
             "or", "pass", "raise", "return", "True", "try", "while", "with", "yield",
         ]
-        for word in keywords:
-            pattern = r"\b" + word + r"\b"
-            self.highlightingRules.append((re.compile(pattern), keywordFormat))
 
         # Builtins (common ones)
         builtins = [
@@ -75,227 +97,211 @@ class PythonHighlighter(QSyntaxHighlighter):
             "setattr", "slice", "sorted", "staticmethod", "str", "sum", "super", "tuple",
             "type", "vars", "zip", "__import__",
         ]
-        for word in builtins:
-            pattern = r"\b" + word + r"\b"
-            self.highlightingRules.append((re.compile(pattern), builtinFormat))
-
-        # Single-line comments
-        self.highlightingRules.append((re.compile(r"#.*"), commentFormat))
-
-        # Strings (handle prefixes f, r, b, u and combinations)
-        # Matches '...', "...", f'...', r"...", br'...', etc.
-        # Basic single/double quotes
-        self.highlightingRules.append((re.compile(r"'(?:[^'\\]|\\.)*'"), stringFormat))
-        self.highlightingRules.append((re.compile(r'"(?:[^"\\]|\\.)*"'), stringFormat))
-        # With prefixes (optional group for prefix, required group for quotes)
-        self.highlightingRules.append(
-            (re.compile(r"[fFrRbBuU]{1,2}'(?:[^'\\]|\\.)*'"), stringFormat)
-        )
-        self.highlightingRules.append(
-            (re.compile(r'[fFrRbBuU]{1,2}"(?:[^"\\]|\\.)*"'), stringFormat)
-        )
-        # Note: This doesn't separately color the prefix, which is simpler.
-
-        # Numbers (order matters: floats before ints to avoid partial matches)
-        # Floats (including scientific notation like 1e3, .5, 1.)
-        self.highlightingRules.append(
-            (re.compile(r"\b\d+\.\d*([eE][-+]?\d+)?\b"), numberFormat)
-        )
-        self.highlightingRules.append(
-            (re.compile(r"\.\d+([eE][-+]?\d+)?\b"), numberFormat)
-        )
-        self.highlightingRules.append(
-            (re.compile(r"\b\d+[eE][-+]?\d+\b"), numberFormat)
-        )
-         # Integers (decimal, hex, octal, binary) after floats
-        self.highlightingRules.append(
-            (re.compile(r"\b0[xX][0-9a-fA-F]+\b"), numberFormat)
-        )
-        self.highlightingRules.append(
-            (re.compile(r"\b0[oO][0-7]+\b"), numberFormat)
-        )
-        self.highlightingRules.append(
-            (re.compile(r"\b0[bB][01]+\b"), numberFormat)
-        )
-        self.highlightingRules.append(
-            (re.compile(r"\b\d+\b"), numberFormat) # Plain integers last
-        )
-
-
-        # Decorators (@ followed by identifier)
-        self.highlightingRules.append((re.compile(r"@\w+"), decoratorFormat))
-
-        # Function and class definition names (using capture group 1)
-        self.highlightingRules.append(
-            (re.compile(r"\bdef\s+([A-Za-z_]\w*)"), funcClassFormat, 1) # Group 1 is the name
-        )
-        self.highlightingRules.append(
-            (re.compile(r"\bclass\s+([A-Za-z_]\w*)"), funcClassFormat, 1) # Group 1 is the name
-        )
-
-        # self/cls parameters
-        self.highlightingRules.append((re.compile(r"\bself\b"), selfFormat))
-        self.highlightingRules.append((re.compile(r"\bcls\b"), selfFormat))
 
-        # --- Multi-line String Handling ---
-        self.multiLineStringFormat = stringFormat
-        # Start patterns for """ and '''
-        self.triSingleQuoteStart = re.compile(r"'''")
-        self.triDoubleQuoteStart = re.compile(r'"""')
-        # End patterns (kept simple, state machine handles context)
-        self.triSingleQuoteEnd = re.compile(r"'''")
-        self.triDoubleQuoteEnd = re.compile(r'"""')
+        rules = [
+            # Single-line comments
+            ("comment", r"#.*", commentFormat),
+            # Strings, optionally prefixed (f, r, b, u and combinations): '...', "...", f'...', br"...", etc.
+            # Note: This doesn't separately color the prefix, which is simpler.
+            ("string", r"[fFrRbBuU]{0,2}'(?:[^'\\]|\\.)*'|[fFrRbBuU]{0,2}\"(?:[^\"\\]|\\.)*\"", stringFormat),
+            # Function and class definition names ("def"/"class" itself gets keywordFormat)
+            ("definition", r"\b(?P<definition_keyword>def|class)\s+(?P<definition_name>[A-Za-z_]\w*)", funcClassFormat),
+            # Any other identifier; keywords, builtins and self/cls are told apart by a dict lookup
+            # (see identifierFormats) instead of an alternation of every word
+            ("identifier", r"[^\W\d]\w*", None),
+            # Numbers: hex, octal, binary, floats (1., 1.5e3), integers with optional exponent (1e3), one shared \b
+            # anchor; a leading-dot float (.5) sits outside it, since \b can't match before the dot after a space
+            ("number", r"\b(?:0[xX][0-9a-fA-F]+|0[oO][0-7]+|0[bB][01]+|\d+\.\d*(?:[eE][-+]?\d+)?|\d+(?:[eE][-+]?\d+)?)\b"
+                       r"|\.\d+(?:[eE][-+]?\d+)?\b", numberFormat),
+            # Decorators (@ followed by identifier)
+            ("decorator", r"@\w+", decoratorFormat),
+        ]
+        cls.highlightPattern = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern, _fmt in rules))
+        cls.highlightFormats = {name: fmt for name, _pattern, fmt in rules}
+        cls.identifierFormats = {word: keywordFormat for word in keywords}
+        cls.identifierFormats.update((word, builtinFormat) for word in builtins)
+        cls.identifierFormats.update((word, selfFormat) for word in ("self", "cls")) # self/cls parameters
+        cls.keywordFormat = keywordFormat
 
+        # --- Multi-line String Handling ---
+        cls.multiLineStringFormat = stringFormat
+        # Start pattern for both ''' and """ (one search finds whichever comes first)
+        cls.tripleQuoteStart = re.compile(r"'''|\"\"\"")
+        # Delimiter per state, for the end search (a plain str.find; the state machine handles context)
+        cls.tripleQuoteDelimiters = {1: "'''", 2: '"""'}
+        cls._rules_built = True
+
+    def prepare_for_bulk_text(self, line_count: int):
+        """
+        Call right before replacing the whole document (e.g. setPlainText).
+
+        For texts longer than HIGHLIGHT_INITIAL_BLOCKS lines, only the first
+        screenful is highlighted synchronously; the remaining lines follow in
+        chunks once control returns to the event loop.
+        """
+        if line_count <= HIGHLIGHT_INITIAL_BLOCKS:
+            self._highlight_limit = None; self._chunk_timer.stop(); return
+        self._highlight_limit = HIGHLIGHT_INITIAL_BLOCKS
+        self._chunk_timer.start()
+
+    def _highlight_next_chunk(self):
+        document = self.document()
+        if document is None or self._highlight_limit is None: return
+        first_pending = document.findBlockByNumber(self._highlight_limit)
+        self._highlight_limit += HIGHLIGHT_CHUNK_BLOCKS
+        if self._highlight_limit >= document.blockCount(): self._highlight_limit = None
+        # Re-highlighting the first pending block cascades through the chunk, since each
+        # block's state changes from _STATE_PENDING; it stops at the next deferred block.
+        if first_pending.isValid(): self.rehighlightBlock(first_pending)
+        if self._highlight_limit is not None: self._chunk_timer.start()
 
     def highlightBlock(self, text: str):
         """Highlights a single block of text (typically one line)."""
-        # --- Apply Single-Line Rules ---
-        # Apply rules that don't span lines first
-        for rule_tuple in self.highlightingRules:
-            pattern = rule_tuple[0]
-            fmt = rule_tuple[1]
-            # Check if a specific capture group should be formatted
-            capture_group_index = rule_tuple[2] if len(rule_tuple) > 2 else 0
-
-            # Use finditer to catch all occurrences in the line
-            for match in pattern.finditer(text):
-                try:
-                    # Get the start and end positions of the match (or capture group)
-                    start, end = match.span(capture_group_index)
-
-                    # Apply the format for the calculated span
-                    # Check for valid span to avoid potential errors
-                    if 0 <= start < end <= len(text):
-                        self.setFormat(start, end - start, fmt)
-                    # else: # Optional debug for invalid spans
-                        # print(f"Debug: Invalid span ({start}, {end}) for pattern '{pattern.pattern}' in text: '{text[:50]}...'")
-                except IndexError:
-                    # This can happen if the capture group doesn't exist in a specific match
-                    # (e.g., regex allows optional parts) - safely ignore these cases.
-                    # print(f"Debug: Capture group {capture_group_index} not found for pattern '{pattern.pattern}'")
-                    pass
-
+        if self._highlight_limit is not None and self.currentBlock().blockNumber() >= self._highlight_limit:
+            self.setCurrentBlockState(_STATE_PENDING); return
+        previous_state = self.previousBlockState()
+        spans, state = self._compute_spans(text, previous_state if previous_state in (1, 2) else 0)
+        for start, length, fmt in spans:
+            self.setFormat(start, length, fmt)
+        self.setCurrentBlockState(state)
+
+    @classmethod
+    @lru_cache(maxsize=HIGHLIGHT_CACHE_LINES)
+    def _compute_spans(cls, text: str, previous_state: int) -> tuple[tuple[tuple[int, int, QTextCharFormat], ...], int]:
+        """
+        Works out the formatting of one line: ((start, length, format), ...) and the block
+        state it ends in, given the state the previous line ended in (0, 1 or 2, see below).
+        Memoized: unchanged lines (and repeated ones, e.g. blank lines or common statements)
+        re-highlighted after an edit or on reload are replayed without running any regexes.
+        """
+        string_format = cls.multiLineStringFormat
+        string_spans = [] # (start, end) of the multi-line string parts in this line
 
         # --- Multi-line String Highlighting Logic (State Machine) ---
+        # Worked out first: these parts override whatever the single-line rules find inside them
         # State: 0 = Normal Code, 1 = Inside ''', 2 = Inside """
-        self.setCurrentBlockState(0)
-        block_state = self.previousBlockState() # Get state from the end of previous block
+        state = 0
+        block_state = previous_state # State from the end of previous block
         search_offset = 0 # Where to start searching for delimiters in the current block
 
         # --- Handle Continuation from Previous Block ---
-        if block_state == 1: # Previous block ended inside '''
-            end_match = self.triSingleQuoteEnd.search(text)
-            if end_match:
+        if block_state in (1, 2): # Previous block ended inside ''' or """
+            end_index = text.find(cls.tripleQuoteDelimiters[block_state])
+            if end_index != -1:
                 # Found the end delimiter in this block
-                end_pos = end_match.end()
-                self.setFormat(0, end_pos, self.multiLineStringFormat) # Format up to the end
+                end_pos = end_index + 3
+                string_spans.append((0, end_pos)) # Format up to the end
                 search_offset = end_pos # Start searching for new strings after this one
                 # State returns to 0 (Normal Code) implicitly by not setting it
             else:
-                # String continues to the next block
-                self.setCurrentBlockState(1) # Maintain state 1
-                self.setFormat(0, len(text), self.multiLineStringFormat) # Format whole block
-                return # Nothing else to do in this block
-
-        elif block_state == 2: # Previous block ended inside """
-            end_match = self.triDoubleQuoteEnd.search(text)
-            if end_match:
-                # Found the end delimiter in this block
-                end_pos = end_match.end()
-                self.setFormat(0, end_pos, self.multiLineStringFormat) # Format up to the end
-                search_offset = end_pos # Start searching for new strings after this one
-                # State returns to 0 (Normal Code) implicitly
-            else:
-                # String continues to the next block
-                self.setCurrentBlockState(2) # Maintain state 2
-                self.setFormat(0, len(text), self.multiLineStringFormat) # Format whole block
-                return # Nothing else to do in this block
+                # String continues to the next block: the whole block is string, nothing else to do
+                return ((0, len(text), string_format),), block_state # Maintain the state
 
         # --- Search for New Multiline Strings Starting in This Block ---
-        # This loop finds the *next* starting delimiter (''' or """)
+        # This loop finds the *next* starting delimiter (''' or """); most lines contain neither,
+        # and two substring checks are cheaper than a regex search that finds nothing
+        if "'''" not in text and '"""' not in text:
+            search_offset = len(text)
         while search_offset < len(text):
-            # Find the nearest start delimiter from the current offset
-            start_single_match = self.triSingleQuoteStart.search(text, search_offset)
-            start_double_match = self.triDoubleQuoteStart.search(text, search_offset)
-
-            # Determine which delimiter comes first (if any)
-            if start_single_match and start_double_match:
-                if start_single_match.start() < start_double_match.start():
-                    start_match = start_single_match
-                    current_state = 1 # Entering ''' state
-                    delimiter_end_pattern = self.triSingleQuoteEnd
-                else:
-                    start_match = start_double_match
-                    current_state = 2 # Entering """ state
-                    delimiter_end_pattern = self.triDoubleQuoteEnd
-            elif start_single_match:
-                start_match = start_single_match
-                current_state = 1
-                delimiter_end_pattern = self.triSingleQuoteEnd
-            elif start_double_match:
-                start_match = start_double_match
-                current_state = 2
-                delimiter_end_pattern = self.triDoubleQuoteEnd
-            else:
+            start_match = cls.tripleQuoteStart.search(text, search_offset)
+            if not start_match:
                 # No more multiline string starts found in the remainder of the block
                 break
-
+            delimiter = start_match.group()
+            current_state = 1 if delimiter == "'''" else 2
             string_start_index = start_match.start()
 
             # Find the corresponding end delimiter *after* the start delimiter
-            # Important: Start search for end *after* the start delimiter begins
-            end_match = delimiter_end_pattern.search(text, start_match.end())
+            end_index = text.find(delimiter, start_match.end())
 
-            if end_match:
+            if end_index != -1:
                 # Multiline string starts and ends within this block
-                string_end_index = end_match.end()
-                self.setFormat(string_start_index, string_end_index - string_start_index, self.multiLineStringFormat)
+                string_end_index = end_index + 3
+                string_spans.append((string_start_index, string_end_index))
                 # Continue searching for the *next* multiline string start after this one ends
                 search_offset = string_end_index
             else:
                 # Multiline string starts here but continues into the next block
-                self.setCurrentBlockState(current_state) # Set state for the next block
+                state = current_state # Set state for the next block
                 # Format from the start delimiter to the end of the current block
-                self.setFormat(string_start_index, len(text) - string_start_index, self.multiLineStringFormat)
+                string_spans.append((string_start_index, len(text)))
                 # Since the string continues, we are done processing this block
                 break # Exit the while loop
 
+        # --- Apply Single-Line Rules ---
+        # One pass of the master pattern; matches entirely inside a multi-line string part are dropped
+        spans = []
+        formats = cls.highlightFormats; identifier_formats = cls.identifierFormats
+        def add(start: int, end: int, fmt: QTextCharFormat):
+            for string_start, string_end in string_spans:
+                if string_start <= start and end <= string_end: return
+            spans.append((start, end - start, fmt))
+        for match in cls.highlightPattern.finditer(text):
+            rule = match.lastgroup # The matching top-level alternative
+            if rule == "identifier":
+                fmt = identifier_formats.get(match.group())
+                if fmt is not None: add(match.start(), match.end(), fmt)
+                continue
+            if rule == "definition":
+                keyword_start, keyword_end = match.span("definition_keyword")
+                add(keyword_start, keyword_end, cls.keywordFormat)
+                start, end = match.span("definition_name") # Only the name gets the definition format
+            else:
+                start, end = match.span()
+            add(start, end, formats[rule])
+        # The multi-line parts go last, so they override any single-line match they partly overlap
+        spans.extend((start, end - start, string_format) for start, end in string_spans)
+
+        # Merge touching spans with the same format, so highlightBlock makes fewer setFormat calls
+        merged = []
+        for span in spans:
+            if merged and merged[-1][2] is span[2] and merged[-1][0] + merged[-1][1] == span[0]:
+                merged[-1] = (merged[-1][0], merged[-1][1] + span[1], span[2])
+            else:
+                merged.append(span)
+        return tuple(merged), state
+
 
 class DiffHighlighter(QSyntaxHighlighter):
     """
     A simple syntax highlighter for unified diff format output.
     Highlights lines starting with '+', '-', or '@@'.
     """
+    _formats_built = False
+
     def __init__(self, document):
         super().__init__(document)
+        # The formats are shared by all instances, like PythonHighlighter's rules
+        if not DiffHighlighter._formats_built: DiffHighlighter._build_formats()
 
+    @classmethod
+    def _build_formats(cls):
         # Format for added lines (+)
-        self.addedFormat = QTextCharFormat()
+        cls.addedFormat = QTextCharFormat()
         # Use background color defined in constants
-        self.addedFormat.setBackground(QColor(COLOR_DIFF_ADDED_BG))
+        cls.addedFormat.setBackground(QColor(COLOR_DIFF_ADDED_BG))
 
         # Format for removed lines (-)
-        self.removedFormat = QTextCharFormat()
+        cls.removedFormat = QTextCharFormat()
         # Use background color defined in constants
-        self.removedFormat.setBackground(QColor(COLOR_DIFF_REMOVED_BG))
+        cls.removedFormat.setBackground(QColor(COLOR_DIFF_REMOVED_BG))
 
         # Format for context/info lines (@@)
-        self.infoFormat = QTextCharFormat()
-        self.infoFormat.setForeground(QColor("#569CD6")) # Blue, similar to keywords
-        self.infoFormat.setFontWeight(QFont.Weight.Bold) # Make context lines bold
+        cls.infoFormat = QTextCharFormat()
+        cls.infoFormat.setForeground(QColor("#569CD6")) # Blue, similar to keywords
+        cls.infoFormat.setFontWeight(QFont.Weight.Bold) # Make context lines bold
+
+        cls.markerFormats = {"+": cls.addedFormat, "-": cls.removedFormat, "@": cls.infoFormat}
+        cls._formats_built = True
 
     def highlightBlock(self, text: str):
         """Highlights a single block (line) of diff text."""
-        # Check the start of the line for diff markers
-        # Use startswith for efficiency
-        if text.startswith("+") and not text.startswith("+++"):
-            # Apply added format to the entire line
-            self.setFormat(0, len(text), self.addedFormat)
-        elif text.startswith("-") and not text.startswith("---"):
-            # Apply removed format to the entire line
-            self.setFormat(0, len(text), self.removedFormat)
-        elif text.startswith("@@"):
-            # Apply info format to the entire line
-            self.setFormat(0, len(text), self.infoFormat)
+        # The first character picks the candidate format with one dict lookup
+        fmt = self.markerFormats.get(text[:1])
         # Lines without these prefixes (context lines) will retain the default format
+        if fmt is None: return
+        # "+++"/"---" are file headers, not changes; info lines start with "@@"
+        if text.startswith(("+++", "---")) or (fmt is self.infoFormat and not text.startswith("@@")): return
+        # Apply the format to the entire line
+        self.setFormat(0, len(text), fmt)
 # --- END OF FILE highlighters.txt ---
\ No newline at end of file
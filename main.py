@@ -1,62 +1,70 @@
 import sys
 import multiprocessing
 
-# --- Add this block at the top ---
+# --- Startup debug log (opt-in) ---
 import os
 import traceback
-import time # Import time for unique log filenames if needed
+from pathlib import Path
+from constants import CODE_HELPER_DATA_DIR_NAME, DEBUG_ENV_VAR, DEBUG_LOG_FILE_NAME, DEBUG_LOG_MAX_BYTES, DEBUG_LOG_BACKUP_COUNT
 
-# Try to determine the base directory reliably
-try:
-    frozen = getattr(sys, 'frozen', False)
-    if frozen and hasattr(sys, '_MEIPASS'):
-        # Running in a PyInstaller bundle (_MEIPASS is temp dir)
-        bundle_dir = sys._MEIPASS
-    else:
-        # Running as a normal script
-        bundle_dir = os.path.dirname(os.path.abspath(__file__))
+def _write_debug_log():
+    """
+    Appends startup diagnostics (paths, PyInstaller bundle info) to a rotating log in
+    ~/.code_helper. Runs before the Qt imports, so it still works if those fail.
+    """
+    import logging
+    from logging.handlers import RotatingFileHandler
+    try:
+        # Try to determine the base directory reliably
+        frozen = getattr(sys, 'frozen', False)
+        if frozen and hasattr(sys, '_MEIPASS'):
+            # Running in a PyInstaller bundle (_MEIPASS is temp dir)
+            bundle_dir = sys._MEIPASS
+        else:
+            # Running as a normal script
+            bundle_dir = os.path.dirname(os.path.abspath(__file__))
 
-    # Define log file path in user's home directory
-    log_filename = f"code_helper_debug_{int(time.time())}.log" # Add timestamp
-    log_path = os.path.join(os.path.expanduser("~"), log_filename)
+        log_dir = Path.home() / CODE_HELPER_DATA_DIR_NAME
+        log_dir.mkdir(parents=True, exist_ok=True)
+        handler = RotatingFileHandler(log_dir / DEBUG_LOG_FILE_NAME, maxBytes=DEBUG_LOG_MAX_BYTES, backupCount=DEBUG_LOG_BACKUP_COUNT, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger = logging.getLogger("code_helper.startup")
+        logger.addHandler(handler); logger.setLevel(logging.DEBUG); logger.propagate = False
 
-    # Write debug info to the log file
-    with open(log_path, "w", encoding="utf-8") as f:
-        f.write(f"Timestamp: {time.asctime()}\n")
-        f.write(f"Running from CWD: {os.getcwd()}\n")
-        f.write(f"sys.executable: {sys.executable}\n")
-        f.write(f"sys.frozen: {frozen}\n")
-        f.write(f"sys._MEIPASS exists: {hasattr(sys, '_MEIPASS')}\n")
+        # Write debug info to the log file
+        logger.debug(f"Running from CWD: {os.getcwd()}")
+        logger.debug(f"sys.executable: {sys.executable}")
+        logger.debug(f"sys.frozen: {frozen}")
+        logger.debug(f"sys._MEIPASS exists: {hasattr(sys, '_MEIPASS')}")
         if hasattr(sys, '_MEIPASS'):
-            f.write(f"sys._MEIPASS value: {sys._MEIPASS}\n")
-        f.write(f"Bundle dir determined: {bundle_dir}\n")
-        f.write(f"os.environ['PATH']: {os.environ.get('PATH', 'Not Set')}\n")
-
-except Exception as e:
-    # Attempt to log any error during the debug logging itself
-    try:
-        # Define log_path again in case it failed before creation
-        log_path_err = os.path.join(os.path.expanduser("~"), f"code_helper_debug_ERROR_{int(time.time())}.log")
-        with open(log_path_err, "w", encoding="utf-8") as f_err:
-            f_err.write(f"Timestamp: {time.asctime()}\n")
-            f_err.write("Error during initial debug logging:\n")
-            f_err.write(traceback.format_exc())
+            logger.debug(f"sys._MEIPASS value: {sys._MEIPASS}")
+        logger.debug(f"Bundle dir determined: {bundle_dir}")
+        logger.debug(f"os.environ['PATH']: {os.environ.get('PATH', 'Not Set')}")
+        handler.close(); logger.removeHandler(handler)
     except Exception:
-        pass # Ignore errors during error logging
-# --- End of debug block ---
+        print("Error during startup debug logging:")
+        traceback.print_exc()
 
+# Only when asked for (e.g. CODE_HELPER_DEBUG=1), and not again in Scan & Run's pool
+# processes, which re-import this module as __mp_main__ on spawn-based platforms
+if __name__ == "__main__" and os.environ.get(DEBUG_ENV_VAR):
+    _write_debug_log()
+# --- End of debug block ---
 
-# --- PyQt6 Imports ---
-# Import QApplication from QtWidgets
-from PyQt6.QtWidgets import QApplication
-from PyQt6.QtCore import Qt # Keep this if you use Qt flags directly here
-# --- Project Module Imports (Direct Imports for Flat Structure) ---
-from app import App
-from constants import APP_NAME, ORG_NAME, APP_VERSION
-# from utils import resource_path # Import if needed directly here
 
 def main():
     """Main function to initialize and run the application."""
+    # The GUI imports live here rather than at module level: Scan & Run's pool processes
+    # re-import this module (as __mp_main__) on spawn-based platforms such as Windows and
+    # shouldn't have to load the widgets, the app and its dependencies just to start.
+    # --- PyQt6 Imports ---
+    # Import QApplication from QtWidgets
+    from PyQt6.QtWidgets import QApplication
+    # --- Project Module Imports (Direct Imports for Flat Structure) ---
+    from app import App
+    from constants import APP_NAME, ORG_NAME, APP_VERSION
+    # from utils import resource_path # Import if needed directly here
+
     # --- Application Setup ---
     # Consider setting application attributes for better OS integration
     # and potential future settings persistence using QSettings.
@@ -0,0 +1,165 @@
+# --- regex_backend.py ---
+"""
+Regex engine selection for the Scan & Run find/replace pipeline.
+
+Patterns are always compiled (and validated) with Python's `re`. When the
+optional `google-re2` package is installed, workers switch to RE2 (linear-time,
+no backtracking) for ASCII patterns and ASCII file contents, but only for a
+vetted syntax subset on which RE2 gives the same results as `re` (see
+`_re2_safe_syntax`) and only for patterns that can't match the empty string
+(the two engines step past empty matches differently in `sub`). Anything else,
+including backreferences, lookaround, `{,n}`, `\\s` and POSIX classes, stays on `re`.
+(No internal project imports needed here)
+"""
+
+import re
+from functools import lru_cache
+
+try:
+    from re import _parser as _re_parser # Python 3.11+
+except ImportError:
+    import sre_parse as _re_parser
+
+try:
+    import re2
+    if not hasattr(re2, "Options"): # A different "re2" package (e.g. pyre2) with another API
+        re2 = None
+except ImportError:
+    re2 = None
+
+# `re` flags that RE2 supports as inline flags
+_RE2_INLINE_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+_RE2_SUPPORTED_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE
+# Escapes RE2 reads the same way as `re` on ASCII text (plus any escaped punctuation). Not \s / \S:
+# RE2's \s lacks \v and \x1c-\x1f. Inside a class \b means backspace to `re`, which RE2 rejects.
+_RE2_SAFE_ESCAPES = frozenset("dDwWbBAntrfx")
+_RE2_SAFE_CLASS_ESCAPES = frozenset("dDwWntrfx")
+# Counted repeats RE2 agrees on; `re` also takes {,n}, which RE2 reads as literal text
+_RE2_REPEAT_RE = re.compile(r"\{\d+(?:,\d*)?\}")
+# Plain, non-capturing and named groups, and scoped or leading i/m/s flags
+_RE2_GROUP_OPEN_RE = re.compile(r"\((?!\?)|\(\?(?:P<\w+>|[ims]*(?:-[ims]+)?[:)])")
+
+def compile_find_pattern(pattern: str) -> tuple[re.Pattern | None, str | None]:
+    """
+    Compiles the user's find regex once per scan, so workers never recompile it.
+
+    Returns:
+        A tuple containing:
+        - The compiled pattern, or None if the pattern is invalid.
+        - An error message string if compilation failed, otherwise None.
+    """
+    try:
+        return re.compile(pattern), None
+    except re.error as regex_error:
+        return None, f"Invalid regex pattern: {regex_error}"
+
+def select_engine(compiled_pattern: re.Pattern, text: str):
+    """
+    Returns the fastest engine that matches `compiled_pattern` exactly on `text`.
+
+    The returned object exposes the `re.Pattern` API used by the pipeline (`sub`).
+    """
+    if not text.isascii():
+        return compiled_pattern
+    return _re2_variant(compiled_pattern) or _ascii_variant(compiled_pattern) or compiled_pattern
+
+def _escaped_chars(pattern: str) -> set[str]:
+    """Returns the characters escaped by a backslash in `pattern` (an escaped backslash counts once)."""
+    escaped = set()
+    index = pattern.find("\\")
+    while index != -1 and index + 1 < len(pattern):
+        escaped.add(pattern[index + 1])
+        index = pattern.find("\\", index + 2)
+    return escaped
+
+@lru_cache(maxsize=8)
+def _ascii_variant(compiled_pattern: re.Pattern) -> re.Pattern | None:
+    """
+    Returns an re.ASCII build of an ASCII-only pattern, or None if not applicable.
+
+    On ASCII-only input the ASCII build matches what the Unicode build would,
+    except for \\s / \\S: Unicode \\s also matches the separators \\x1c-\\x1f,
+    so patterns using them keep the Unicode build.
+    """
+    if not isinstance(compiled_pattern.pattern, str) or not compiled_pattern.pattern.isascii():
+        return None
+    if not _escaped_chars(compiled_pattern.pattern).isdisjoint("sS"):
+        return None
+    try:
+        return re.compile(compiled_pattern.pattern, (compiled_pattern.flags & ~re.UNICODE) | re.ASCII)
+    except (re.error, ValueError): # e.g. an inline (?u) flag conflicts with re.ASCII
+        return None
+
+@lru_cache(maxsize=8)
+def _re2_variant(compiled_pattern: re.Pattern):
+    """Returns an RE2 build of an ASCII-only pattern, or None if RE2 can't run it identically."""
+    if re2 is None:
+        return None
+    pattern = compiled_pattern.pattern
+    flags = compiled_pattern.flags
+    if not isinstance(pattern, str) or not pattern.isascii():
+        return None
+    if flags & ~_RE2_SUPPORTED_FLAGS:
+        return None
+    if "$" in pattern and not flags & re.MULTILINE:
+        return None # re's "$" also matches before a trailing newline; RE2's does not
+    if not _re2_safe_syntax(pattern) or _min_match_width(compiled_pattern) == 0:
+        return None
+
+    inline_flags = "".join(letter for flag, letter in _RE2_INLINE_FLAGS if flags & flag)
+    options = re2.Options()
+    options.log_errors = False
+    try:
+        return re2.compile(f"(?{inline_flags}){pattern}" if inline_flags else pattern, options)
+    except re2.error:
+        return None
+
+def _re2_safe_syntax(pattern: str) -> bool:
+    """True if `pattern` only uses syntax that RE2 parses the same way as `re`."""
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            escaped = pattern[index + 1:index + 2]
+            if escaped not in _RE2_SAFE_ESCAPES and (not escaped or escaped.isalnum()): return False
+            index += 2
+        elif char == "[":
+            index = _re2_safe_class_end(pattern, index)
+            if index == -1: return False
+        elif char == "{":
+            repeat = _RE2_REPEAT_RE.match(pattern, index)
+            if not repeat: return False
+            index = repeat.end()
+        elif char == "(":
+            group_open = _RE2_GROUP_OPEN_RE.match(pattern, index)
+            if not group_open: return False # Lookaround, backreference, comment, atomic group...
+            index = group_open.end()
+        else:
+            index += 1
+    return True
+
+def _re2_safe_class_end(pattern: str, index: int) -> int:
+    """Returns the index after the character class starting at `index`, or -1 if RE2 might read it differently."""
+    index += 1
+    if pattern.startswith("^", index): index += 1
+    if pattern.startswith("]", index): index += 1 # A leading "]" is a literal in both engines
+    while index < len(pattern):
+        char = pattern[index]
+        if char == "\\":
+            escaped = pattern[index + 1:index + 2]
+            if escaped not in _RE2_SAFE_CLASS_ESCAPES and (not escaped or escaped.isalnum()): return -1
+            index += 2
+        elif char == "[":
+            return -1 # RE2 reads [:alpha:] etc. as POSIX classes; `re` as literal characters
+        elif char == "]":
+            return index + 1
+        else:
+            index += 1
+    return -1
+
+def _min_match_width(compiled_pattern: re.Pattern) -> int:
+    """Length of the shortest string `compiled_pattern` can match (0 if unknown)."""
+    try:
+        return _re_parser.parse(compiled_pattern.pattern, compiled_pattern.flags).getwidth()[0]
+    except Exception: # The parser is internal to `re`; if its API changes, treat the pattern as unvetted
+        return 0
@@ -0,0 +1,53 @@
+# --- tests/test_regex_backend.py ---
+"""
+Scan & Run must rewrite files exactly as `re.sub` would, whichever engine
+regex_backend.select_engine picks (RE2, the re.ASCII build, or plain `re`).
+"""
+
+import re
+
+import pytest
+
+import regex_backend
+from regex_backend import select_engine
+
+# Patterns where RE2 or re.ASCII disagree with `re` unless they are kept off them
+PATTERNS = [
+    r"a{,2}", r"a{2}", r"a{1,3}", r"x{",
+    r"\s+", r"[^\S\n]+", r"\S+", r"\\s",
+    r"[[:alpha:]]+", r"[]a]", r"[\d-]+",
+    r"\b", r"x*", r"", r"^", r"a|",
+    r"\w+\b", r"\bdef\b", r"\d+", r"\.", r"\x41",
+    r"a|ab", r"(a)(b)?", r"(?P<n>a)\1", r"foo(?=bar)",
+    r"(?i)ab", r"(?i:a)b", r"(?m)^a$", r"a$", r"a.c", r"(?s)a.c",
+]
+TEXTS = [
+    "aaaa", "x\x0by z", "a\x1cb\x1fc", "ab:] a]", "ab cd", "abxd",
+    "def f():\n    return 1\n", "1-2 x", "AB ab Ab", "a\na\n", "a\nc abc",
+    "foobar foo", "aa a", "x{ xx{",
+]
+REPLACEMENTS = ["X", r"<\g<0>>", r"[\1]"]
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+@pytest.mark.filterwarnings("ignore::FutureWarning") # "Possible nested set" for [[:alpha:]]
+def test_selected_engine_matches_re(pattern):
+    compiled = re.compile(pattern)
+    for text in TEXTS:
+        engine = select_engine(compiled, text)
+        for replacement in REPLACEMENTS:
+            try:
+                expected = compiled.sub(replacement, text)
+            except (re.error, IndexError):
+                continue # Template refers to a group the pattern doesn't have
+            assert engine.sub(replacement, text) == expected, (pattern, text, replacement)
+
+@pytest.mark.skipif(regex_backend.re2 is None, reason="google-re2 not installed")
+@pytest.mark.parametrize("pattern", [r"a{,2}", r"\s+", r"[[:alpha:]]", r"\b", r"x*", r"(?P<n>a)\1", r"foo(?=bar)"])
+@pytest.mark.filterwarnings("ignore::FutureWarning")
+def test_unvetted_patterns_stay_off_re2(pattern):
+    assert regex_backend._re2_variant(re.compile(pattern)) is None
+
+@pytest.mark.skipif(regex_backend.re2 is None, reason="google-re2 not installed")
+@pytest.mark.parametrize("pattern", [r"\d+", r"\bdef\b", r"(?i)ab", r"a{1,3}", r"[\d-]+"])
+def test_vetted_patterns_use_re2(pattern):
+    assert regex_backend._re2_variant(re.compile(pattern)) is not None
@@ -1,16 +1,22 @@
 
 import os
 import re
+import time
 import shutil
 import difflib
 import traceback
+import multiprocessing
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtCore import QThread, QObject, QRunnable, pyqtSignal
 
 # --- CHANGED IMPORT ---
 from formatter_utils import preprocess_and_format_with_black # Use the new formatter utility
 # --- END CHANGE ---
 from utils import backup_and_redo, safe_write_file
+from constants import REPLACEMENT_POOL_SIZE, LOG_DIFF_MAX_LINES, PROGRESS_BATCH_SIZE, PROGRESS_BATCH_INTERVAL_MS
+from regex_backend import select_engine
 
 # --- File Scanning Thread ---
 class FileLoaderThread(QThread):
@@ -59,11 +65,11 @@ class FileLoaderThread(QThread):
                 self.files_loaded.emit([], self.folder_path) # Emit empty list
                 return
 
-            # Use rglob for recursive globbing, yields Path objects directly
+            # Walk with os.scandir (cached entry types, no per-entry stat like rglob)
             # Wrap in try/except in case of permission errors during iteration itself
             iterator = None
             try:
-                 iterator = folder.rglob("*.py")
+                 iterator = _iter_python_files(self.folder_path)
             except PermissionError as e:
                  error_msg = f"Permission error starting scan in '{self.folder_path}': {e}"
                  print(error_msg)
@@ -85,16 +91,14 @@ class FileLoaderThread(QThread):
                     # Don't emit error, just stop and emit potentially partial list later
                     break # Exit the loop if cancelled
 
-                # Process the found item
+                # Process the found item (a regular file or a symlink to one)
                 try:
-                    # Ensure it's actually a file (rglob might yield dirs if pattern allows)
-                    # and check if we can read it to avoid issues later.
-                    if item.is_file() and os.access(str(item), os.R_OK):
-                        files_found.append(item)
-                    elif item.is_file(): # It's a file but not readable
+                    # Check if we can read it to avoid issues later.
+                    if os.access(item, os.R_OK):
+                        files_found.append(Path(item))
+                    else: # It's a file but not readable
                         print(f"Warning: Skipping non-readable file: {item}")
                         # Optionally emit a warning signal here
-                    # Ignore directories yielded by rglob if pattern was less specific
                 except OSError as os_err:
                     # Handle specific OS errors during file access check
                     print(f"Warning: Cannot access file {item} during scan: {os_err}")
@@ -121,31 +125,372 @@ class FileLoaderThread(QThread):
             self.error_occurred.emit(error_msg)
             self.files_loaded.emit([], self.folder_path) # Emit empty list on error
 
+def _iter_python_files(root: str):
+    """
+    Yields the paths (str) of all `*.py` files under `root`, like Path.rglob("*.py").
+
+    Uses os.scandir, whose entries carry the file type from the directory listing,
+    so only symlinks need an extra stat. Symlinked directories are not followed
+    (same as rglob); unreadable subdirectories are skipped with a warning.
+    """
+    pending_dirs = [root]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif os.path.normcase(entry.name).endswith(".py") and entry.is_file():
+                            yield entry.path
+                    except OSError as entry_err:
+                        print(f"Warning: Cannot access {entry.path} during scan: {entry_err}")
+        except OSError as dir_err:
+            print(f"Warning: Skipping unreadable directory {current_dir}: {dir_err}")
+
+# --- Editor Formatting Worker (QThreadPool) ---
+class FormatSignals(QObject):
+    """
+    Signals for FormatWorker (QRunnable is not a QObject, so it can't own signals).
+
+    Signals:
+        finished (str, object, object): The processed code and an error message string (or None),
+                                        exactly as returned by preprocess_and_format_with_black,
+                                        and the follow-up's result (None without a follow-up).
+    """
+    finished = pyqtSignal(str, object, object)
+
+class FormatWorker(QRunnable):
+    """
+    Runs preprocess_and_format_with_black on a QThreadPool thread, keeping the
+    GUI responsive while Black runs. Create it on the GUI thread so that
+    `signals.finished` is delivered there.
+
+    An optional follow_up(processed_code, error_message) runs next on the same
+    pool thread, for work that needs the formatted code but not the GUI (e.g.
+    reading the target file of a snippet); it must not touch widgets.
+    """
+    def __init__(self, code_string: str, follow_up=None):
+        super().__init__()
+        self.code_string = code_string
+        self.follow_up = follow_up
+        self.signals = FormatSignals()
+
+    def run(self):
+        try:
+            processed_code, error_message = preprocess_and_format_with_black(self.code_string)
+        except Exception as e:
+            traceback.print_exc()
+            processed_code, error_message = self.code_string, f"Unexpected formatting error: {e}"
+        follow_up_result = None
+        if self.follow_up is not None:
+            try:
+                follow_up_result = self.follow_up(processed_code, error_message)
+            except Exception as e:
+                traceback.print_exc()
+                follow_up_result = e
+        self.signals.finished.emit(processed_code, error_message, follow_up_result)
+
+# --- File Operation Worker (QThreadPool) ---
+class FileOpSignals(QObject):
+    """
+    Signals for FileOpWorker.
+
+    Signals:
+        finished (object): None on success, otherwise the exception the operation raised.
+    """
+    finished = pyqtSignal(object)
+
+class FileOpWorker(QRunnable):
+    """
+    Runs a batch of file operations (e.g. the backup/redo/restore copies of an
+    undo) on a QThreadPool thread, so large copies don't block the GUI. The
+    operation is a callable that raises on failure; it runs start to finish,
+    and its outcome is reported once through `signals.finished`.
+    """
+    def __init__(self, operation):
+        super().__init__()
+        self.operation = operation
+        self.signals = FileOpSignals()
+
+    def run(self):
+        try:
+            self.operation()
+        except Exception as e:
+            if not isinstance(e, (PermissionError, OSError, shutil.Error)): traceback.print_exc()
+            self.signals.finished.emit(e)
+            return
+        self.signals.finished.emit(None)
+
+# --- Per-File Replace/Format Worker (runs in pool processes) ---
+# Pool processes are spawned, never forked: forking this multi-threaded Qt process could copy
+# a lock (e.g. formatter_utils' format cache lock) held by a FormatWorker thread, and the
+# child would deadlock on it. Spawn works in frozen builds too (main.py calls freeze_support).
+_POOL_CONTEXT = multiprocessing.get_context("spawn")
+
+# Set in each pool process by _init_worker; lets workers skip queued files after a cancel.
+_worker_cancel_event = None
+
+def _init_worker(cancel_event):
+    """Pool initializer: stores the shared cancellation event in the worker process."""
+    global _worker_cancel_event
+    _worker_cancel_event = cancel_event
+
+def _process_one_file(file_path_str: str, pattern: str | re.Pattern, replacement: str, use_regex: bool) -> tuple[str | None, list[str]]:
+    """
+    Reads, find/replaces, formats (Black), backs up and writes a single file.
+
+    Module-level so it can be pickled and dispatched to a multiprocessing pool.
+
+    Args:
+        file_path_str: Path of the file to process.
+        pattern: The search text, or the compiled regex when use_regex is set. Empty for format-only.
+        replacement: The replacement string.
+        use_regex: Boolean indicating if the pattern is a regular expression.
+
+    Returns:
+        A tuple containing:
+        - The log message for this file, or None if it was skipped after a cancel.
+        - A list of file-specific error messages to surface via error_occurred.
+    """
+    if _worker_cancel_event is not None and _worker_cancel_event.is_set():
+        return None, []
+
+    file_path = Path(file_path_str)
+    errors: list[str] = []
+
+    # Initialize per-file status
+    log_msg = ""
+    file_name = file_path.name # For logging
+    original_content = None
+    read_error = None
+    replacement_error = None
+    format_error = None # Keep variable name, now represents Black error
+    write_error = None
+    backup_redo_error = None
+    content_changed = False
+    final_content_to_write = None
+
+
+    # --- 1. Read Original File ---
+    try:
+        original_content, read_error = _read_file(file_path)
+        if read_error:
+            log_msg = f"[Read Error] {file_name}: {read_error}"
+            errors.append(log_msg)
+            # Skip further processing for this file
+            return log_msg, errors
+    except Exception as e: # Catch unexpected errors during read phase
+         log_msg = f"[Unexpected Read Error] {file_name}: {e}"
+         errors.append(log_msg)
+         return log_msg, errors
+
+
+    modified_content = original_content # Start with original
+
+    # --- 2. Apply Find/Replace (if pattern provided) ---
+    if pattern:
+        try:
+            modified_content, replacement_error = _apply_replacement(
+                original_content, pattern, replacement, use_regex
+            )
+            if replacement_error:
+                log_msg = f"[Replace Error] {file_name}: {replacement_error}"
+                errors.append(log_msg)
+                # Don't format if replacement failed, proceed with original content
+                modified_content = original_content
+                # Fall through to formatting the original content
+        except Exception as e: # Catch unexpected errors during replace phase
+             replacement_error = f"Unexpected error during replace: {e}"
+             log_msg = f"[Unexpected Replace Error] {file_name}: {replacement_error}"
+             errors.append(log_msg)
+             modified_content = original_content # Revert to original
+
+
+    # --- 3. Preprocess and Format Code (using Black) ---
+    # Format the content *after* potential find/replace
+    try:
+         # It handles cleaning, normalization, and Black formatting
+         processed_content, format_error_msg = preprocess_and_format_with_black(modified_content)
+
+         if format_error_msg:
+             # Append format error to log, but keep the preprocessed content
+             format_error = f"Preprocessing/Black formatting failed: {format_error_msg}" # Updated error description
+             log_msg += f"\n[Format Warning] {file_name}: {format_error}" if log_msg else f"[Format Warning] {file_name}: {format_error}"
+             errors.append(f"[Format Warning] {file_name}: {format_error}")
+             # Use the content as it was after preprocessing but *before* Black failure
+             final_content_to_write = processed_content # The function returns the pre-Black state on failure
+         else:
+             # Formatting succeeded
+             final_content_to_write = processed_content
+    except Exception as e: # Catch unexpected errors during format phase
+         format_error = f"Unexpected error during formatting: {e}"
+         log_msg += f"\n[Unexpected Format Error] {file_name}: {format_error}" if log_msg else f"[Unexpected Format Error] {file_name}: {format_error}"
+         errors.append(f"[Unexpected Format Error] {file_name}: {format_error}")
+         # Revert to content before attempting format
+         final_content_to_write = modified_content
+
+
+    # --- 4. Check for Changes and Write File ---
+    if original_content != final_content_to_write:
+        content_changed = True
+        diff_str = "" # Initialize diff string
+
+        # --- 4a. Create Backup and Redo Files ---
+        try:
+            # Use the utility function for backup/redo
+            backup_ok, backup_redo_err_msg = backup_and_redo(file_path)
+            if not backup_ok:
+                backup_redo_error = backup_redo_err_msg or "Failed to create backup/redo files."
+                log_msg += f"\n[Backup/Redo Error] {file_name}: {backup_redo_error}" if log_msg else f"[Backup/Redo Error] {file_name}: {backup_redo_error}"
+                errors.append(f"[Backup/Redo Error] {file_name}: {backup_redo_error}")
+                # Decide whether to proceed with writing if backup fails. Let's stop here.
+                return log_msg, errors # Skip writing this file
+
+        except Exception as e: # Catch unexpected errors during backup/redo phase
+             backup_redo_error = f"Unexpected error during backup/redo: {e}"
+             log_msg += f"\n[Unexpected Backup/Redo Error] {file_name}: {backup_redo_error}" if log_msg else f"[Unexpected Backup/Redo Error] {file_name}: {backup_redo_error}"
+             errors.append(f"[Unexpected Backup/Redo Error] {file_name}: {backup_redo_error}")
+             return log_msg, errors # Skip writing this file
+
+
+        # --- 4b. Generate Diff (Optional but helpful for logs) ---
+        try:
+            diff_lines = difflib.unified_diff( # Lazy: hunks are computed as they are consumed
+                original_content.splitlines(),
+                final_content_to_write.splitlines(),
+                fromfile=f"a/{file_name}",
+                tofile=f"b/{file_name}",
+                lineterm="", # Don't add trailing newline to diff lines
+                n=1 # Context lines (optional, 1 is usually enough for logs)
+            )
+            logged_lines = list(islice(diff_lines, LOG_DIFF_MAX_LINES + 1))
+            if len(logged_lines) > LOG_DIFF_MAX_LINES:
+                logged_lines[-1] = f"... (diff truncated after {LOG_DIFF_MAX_LINES} lines)"
+            diff_str = "\n".join(logged_lines)
+        except Exception as diff_e:
+            print(f"Warning: Could not generate diff for {file_name}: {diff_e}")
+            diff_str = "[Diff generation failed]"
+
+
+        # --- 4c. Write Modified/Formatted Content ---
+        try:
+            # Use the utility function for writing
+            write_ok, write_err_msg = safe_write_file(file_path, final_content_to_write)
+            if not write_ok:
+                write_error = write_err_msg or "Failed to write file."
+                log_msg += f"\n[Write Error] {file_name}: {write_error}" if log_msg else f"[Write Error] {file_name}: {write_error}"
+                errors.append(f"[Write Error] {file_name}: {write_error}")
+                # File wasn't written, but backup/redo might exist. State could be inconsistent.
+            else:
+                # Write successful
+                status = "[Updated]"
+                if format_error: status = "[Updated with Format Warning]"
+                if replacement_error: status = "[Updated with Replace Error]" # Overrides format warning
+                log_msg = f"{status} {file_name}\nDiff:\n{diff_str}"
+
+        except Exception as e: # Catch unexpected errors during write phase
+            write_error = f"Unexpected error during write: {e}"
+            log_msg += f"\n[Unexpected Write Error] {file_name}: {write_error}" if log_msg else f"[Unexpected Write Error] {file_name}: {write_error}"
+            errors.append(f"[Unexpected Write Error] {file_name}: {write_error}")
+
+    else:
+        # No change detected between original and final content
+        content_changed = False
+        if not log_msg: # Only report 'no change' if no other errors occurred
+            log_msg = f"[No change] {file_name}"
+        else: # Append 'no change' info to existing error/warning messages
+             log_msg += f"\n[Info] No effective change for {file_name} despite previous warnings."
+
+    # Ensure a message is returned even if log_msg is somehow empty
+    return log_msg or f"[Processed] {file_name} (Status unknown)", errors
+
+def _read_file(file_path: Path) -> tuple[str | None, str | None]:
+    """Reads file content, handles common errors."""
+    content = None
+    error = None
+    try:
+        # Check existence and read permission explicitly first
+        if not file_path.is_file():
+            raise FileNotFoundError(f"File not found: {file_path}")
+        if not os.access(str(file_path), os.R_OK):
+            raise PermissionError("Permission denied reading file")
+
+        # Try reading with UTF-8 first
+        try:
+            content = file_path.read_text(encoding="utf-8")
+        except UnicodeDecodeError:
+            # Log warning and try fallback (system default)
+            print(f"Warning: Non UTF-8 file {file_path.name}. Trying fallback encoding.")
+            try:
+                content = file_path.read_text(encoding=None) # System default
+            except Exception as fallback_e:
+                raise UnicodeDecodeError("utf-8", b'', 0, 0, f"Not UTF-8 and fallback failed: {fallback_e}") from fallback_e
+
+    except (FileNotFoundError, PermissionError, UnicodeDecodeError) as e:
+        error = str(e)
+    except Exception as e:
+        error = f"Unexpected read error: {e}"
+        traceback.print_exc() # Log unexpected errors fully
+    return content, error
+
+def _apply_replacement(content: str, pattern: str | re.Pattern, replacement: str, use_regex: bool) -> tuple[str, str | None]:
+    """Applies find/replace logic, handles regex errors."""
+    modified_content = content
+    error = None
+    try:
+        if use_regex:
+            # Normally precompiled by the caller; compiling here also catches re.error.
+            compiled_pattern = pattern if isinstance(pattern, re.Pattern) else re.compile(pattern)
+            compiled_pattern.sub(replacement, "") # re validates the template even without a match (RE2 may not)
+            modified_content = select_engine(compiled_pattern, content).sub(replacement, content)
+        else:
+            # Simple string replacement
+            modified_content = content.replace(pattern, replacement)
+    except re.error as regex_error:
+        error = f"Invalid regex pattern: {regex_error}"
+    except Exception as e:
+        error = f"Unexpected error during replacement: {e}"
+        traceback.print_exc()
+    return modified_content, error
+
+
 # --- File Processing (Replace/Format) Thread ---
 class ReplacementThread(QThread):
     """
     Processes a list of files: applies find/replace (optional) and Black formatting.
 
+    The per-file work runs in a multiprocessing pool (Black formatting is CPU-bound);
+    this thread only drives the pool and relays results as Qt signals.
+
     Signals:
-        progress (int, str): Emitted during processing. Provides percentage complete
-                             and a log message for the current file.
+        progress (int, str): Percentage complete and a log message; used for the
+                             pool failure and cancellation messages.
+        progress_batch (list): Per-file results as a list of (percent, log message)
+                               tuples, up to PROGRESS_BATCH_SIZE per emit, so the UI
+                               thread isn't woken once per file.
         finished (): Emitted when all files have been processed or the thread is stopped.
         error_occurred (str): Emitted for file-specific errors that don't stop the
                               entire process (e.g., write error, decode error).
     """
     progress = pyqtSignal(int, str) # Percent, Log Message
+    progress_batch = pyqtSignal(list) # [(Percent, Log Message), ...]
     finished = pyqtSignal()
     error_occurred = pyqtSignal(str) # File-specific error message
 
-    def __init__(self, files: list[Path], pattern: str, replacement: str, use_regex: bool, parent=None):
+    def __init__(self, files: list[Path], pattern: str | re.Pattern, replacement: str, use_regex: bool,
+                 pool_size: int = REPLACEMENT_POOL_SIZE, parent=None):
         """
         Initializes the replacement/formatting thread.
 
         Args:
             files: A list of Path objects representing the files to process.
-            pattern: The search pattern (string or regex). Empty for format-only.
+            pattern: The search text, or a regex precompiled with
+                     regex_backend.compile_find_pattern when use_regex is set. Empty for format-only.
             replacement: The replacement string.
             use_regex: Boolean indicating if the pattern is a regular expression.
+            pool_size: Number of worker processes. 0 uses one per CPU core minus one.
             parent: Optional parent object.
         """
         super().__init__(parent)
@@ -153,12 +498,15 @@ class ReplacementThread(QThread):
         self.pattern = pattern
         self.replacement = replacement
         self.use_regex = use_regex
+        self.pool_size = pool_size if pool_size > 0 else max(1, (os.cpu_count() or 2) - 1)
         self._is_running = True # Flag for cancellation
+        self._cancel_event = _POOL_CONTEXT.Event() # Shared with pool workers
 
     def stop(self):
         """Sets the flag to stop the processing loop."""
         print("Requesting ReplacementThread stop...")
         self._is_running = False
+        self._cancel_event.set()
 
     def run(self):
         """The main execution method of the thread."""
@@ -167,227 +515,57 @@ class ReplacementThread(QThread):
             self.finished.emit() # Nothing to do
             return
 
+        processes = min(self.pool_size, total_files)
+        # Small chunks keep progress flowing and the load balanced across workers
+        chunksize = max(1, min(8, total_files // (processes * 4)))
+        worker = partial(_process_one_file, pattern=self.pattern, replacement=self.replacement, use_regex=self.use_regex)
+
         processed_count = 0
-        for idx, file_path in enumerate(self.files_to_process):
-            if not self._is_running:
-                # Emit final progress before breaking
-                percent = int(((processed_count) / total_files) * 100) if total_files > 0 else 0
-                self.progress.emit(percent, "[Cancelled] Operation stopped before processing remaining files.")
-                print("Replacement thread cancelled.")
-                break # Exit the loop if cancelled
-
-            # Initialize per-file status
-            log_msg = ""
-            file_name = file_path.name # For logging
-            original_content = None
-            read_error = None
-            replacement_error = None
-            format_error = None # Keep variable name, now represents Black error
-            write_error = None
-            backup_redo_error = None
-            content_changed = False
-            final_content_to_write = None
-
-
-            # --- 1. Read Original File ---
-            try:
-                original_content, read_error = self._read_file(file_path)
-                if read_error:
-                    log_msg = f"[Read Error] {file_name}: {read_error}"
-                    self.error_occurred.emit(log_msg)
-                    # Skip further processing for this file
+        batch: list[tuple[int, str]] = []
+        last_emit = 0.0 # time.monotonic() of the last progress_batch emit
+        batch_interval = PROGRESS_BATCH_INTERVAL_MS / 1000
+        try:
+            with _POOL_CONTEXT.Pool(processes, initializer=_init_worker, initargs=(self._cancel_event,)) as pool:
+                file_path_strs = [str(file_path) for file_path in self.files_to_process]
+                results = pool.imap_unordered(worker, file_path_strs, chunksize=chunksize)
+                while True:
+                    # While results are waiting to be shown, only wait for the next file until the
+                    # interval since the last emit runs out, so a slow file doesn't hold them back
+                    timeout = max(0.0, last_emit + batch_interval - time.monotonic()) if batch else None
+                    try:
+                        log_msg, errors = results.next(timeout)
+                    except StopIteration:
+                        break
+                    except multiprocessing.TimeoutError:
+                        self.progress_batch.emit(batch); batch = []; last_emit = time.monotonic()
+                        continue
+                    if log_msg is None:
+                        continue # Skipped by the worker after a cancel request
+                    for error_msg in errors:
+                        self.error_occurred.emit(error_msg)
                     processed_count += 1
                     percent = int(((processed_count) / total_files) * 100)
-                    self.progress.emit(percent, log_msg)
-                    continue # Move to the next file
-            except Exception as e: # Catch unexpected errors during read phase
-                 log_msg = f"[Unexpected Read Error] {file_name}: {e}"
-                 self.error_occurred.emit(log_msg)
-                 processed_count += 1
-                 percent = int(((processed_count) / total_files) * 100)
-                 self.progress.emit(percent, log_msg)
-                 continue # Move to the next file
-
-
-            modified_content = original_content # Start with original
-
-            # --- 2. Apply Find/Replace (if pattern provided) ---
-            if self.pattern:
-                try:
-                    modified_content, replacement_error = self._apply_replacement(
-                        original_content, self.pattern, self.replacement, self.use_regex
-                    )
-                    if replacement_error:
-                        log_msg = f"[Replace Error] {file_name}: {replacement_error}"
-                        self.error_occurred.emit(log_msg)
-                        # Don't format if replacement failed, proceed with original content
-                        modified_content = original_content
-                        # Fall through to formatting the original content
-                except Exception as e: # Catch unexpected errors during replace phase
-                     replacement_error = f"Unexpected error during replace: {e}"
-                     log_msg = f"[Unexpected Replace Error] {file_name}: {replacement_error}"
-                     self.error_occurred.emit(log_msg)
-                     modified_content = original_content # Revert to original
-
-
-            # --- 3. Preprocess and Format Code (using Black) ---
-            # Format the content *after* potential find/replace
-            try:
-                 # --- CHANGED: Use the new utility function ---
-                 # It handles cleaning, normalization, and Black formatting
-                 processed_content, format_error_msg = preprocess_and_format_with_black(modified_content)
-                 # --- END CHANGE ---
-
-                 if format_error_msg:
-                     # Append format error to log, but keep the preprocessed content
-                     format_error = f"Preprocessing/Black formatting failed: {format_error_msg}" # Updated error description
-                     log_msg += f"\n[Format Warning] {file_name}: {format_error}" if log_msg else f"[Format Warning] {file_name}: {format_error}"
-                     self.error_occurred.emit(f"[Format Warning] {file_name}: {format_error}")
-                     # Use the content as it was after preprocessing but *before* Black failure
-                     final_content_to_write = processed_content # The function returns the pre-Black state on failure
-                 else:
-                     # Formatting succeeded
-                     final_content_to_write = processed_content
-            except Exception as e: # Catch unexpected errors during format phase
-                 format_error = f"Unexpected error during formatting: {e}"
-                 log_msg += f"\n[Unexpected Format Error] {file_name}: {format_error}" if log_msg else f"[Unexpected Format Error] {file_name}: {format_error}"
-                 self.error_occurred.emit(f"[Unexpected Format Error] {file_name}: {format_error}")
-                 # Revert to content before attempting format
-                 final_content_to_write = modified_content
-
-
-            # --- 4. Check for Changes and Write File ---
-            if original_content != final_content_to_write:
-                content_changed = True
-                diff_str = "" # Initialize diff string
-
-                # --- 4a. Create Backup and Redo Files ---
-                try:
-                    # Use the utility function for backup/redo
-                    backup_ok, backup_redo_err_msg = backup_and_redo(file_path)
-                    if not backup_ok:
-                        backup_redo_error = backup_redo_err_msg or "Failed to create backup/redo files."
-                        log_msg += f"\n[Backup/Redo Error] {file_name}: {backup_redo_error}" if log_msg else f"[Backup/Redo Error] {file_name}: {backup_redo_error}"
-                        self.error_occurred.emit(f"[Backup/Redo Error] {file_name}: {backup_redo_error}")
-                        # Decide whether to proceed with writing if backup fails. Let's stop here.
-                        processed_count += 1
-                        percent = int(((processed_count) / total_files) * 100)
-                        self.progress.emit(percent, log_msg)
-                        continue # Skip writing this file
-
-                except Exception as e: # Catch unexpected errors during backup/redo phase
-                     backup_redo_error = f"Unexpected error during backup/redo: {e}"
-                     log_msg += f"\n[Unexpected Backup/Redo Error] {file_name}: {backup_redo_error}" if log_msg else f"[Unexpected Backup/Redo Error] {file_name}: {backup_redo_error}"
-                     self.error_occurred.emit(f"[Unexpected Backup/Redo Error] {file_name}: {backup_redo_error}")
-                     processed_count += 1
-                     percent = int(((processed_count) / total_files) * 100)
-                     self.progress.emit(percent, log_msg)
-                     continue # Skip writing this file
-
-
-                # --- 4b. Generate Diff (Optional but helpful for logs) ---
-                try:
-                    diff_str = "\n".join(
-                        difflib.unified_diff(
-                            original_content.splitlines(),
-                            final_content_to_write.splitlines(),
-                            fromfile=f"a/{file_name}",
-                            tofile=f"b/{file_name}",
-                            lineterm="", # Don't add trailing newline to diff lines
-                            n=1 # Context lines (optional, 1 is usually enough for logs)
-                        )
-                    )
-                except Exception as diff_e:
-                    print(f"Warning: Could not generate diff for {file_name}: {diff_e}")
-                    diff_str = "[Diff generation failed]"
-
-
-                # --- 4c. Write Modified/Formatted Content ---
-                try:
-                    # Use the utility function for writing
-                    write_ok, write_err_msg = safe_write_file(file_path, final_content_to_write)
-                    if not write_ok:
-                        write_error = write_err_msg or "Failed to write file."
-                        log_msg += f"\n[Write Error] {file_name}: {write_error}" if log_msg else f"[Write Error] {file_name}: {write_error}"
-                        self.error_occurred.emit(f"[Write Error] {file_name}: {write_error}")
-                        # File wasn't written, but backup/redo might exist. State could be inconsistent.
-                    else:
-                        # Write successful
-                        status = "[Updated]"
-                        if format_error: status = "[Updated with Format Warning]"
-                        if replacement_error: status = "[Updated with Replace Error]" # Overrides format warning
-                        log_msg = f"{status} {file_name}\nDiff:\n{diff_str}"
-
-                except Exception as e: # Catch unexpected errors during write phase
-                    write_error = f"Unexpected error during write: {e}"
-                    log_msg += f"\n[Unexpected Write Error] {file_name}: {write_error}" if log_msg else f"[Unexpected Write Error] {file_name}: {write_error}"
-                    self.error_occurred.emit(f"[Unexpected Write Error] {file_name}: {write_error}")
+                    batch.append((percent, log_msg))
+                    if len(batch) >= PROGRESS_BATCH_SIZE or time.monotonic() - last_emit >= batch_interval:
+                        self.progress_batch.emit(batch); batch = []; last_emit = time.monotonic()
+                if batch: self.progress_batch.emit(batch); batch = []
+                # Let in-flight files finish writing before the pool is torn down
+                pool.close()
+                pool.join()
+        except Exception as e:
+            if batch: self.progress_batch.emit(batch) # Keep already processed files in the log, ahead of the error
+            error_msg = f"[Error] Replacement worker pool failed: {e}"
+            print(error_msg)
+            traceback.print_exc()
+            self.error_occurred.emit(error_msg)
+            self.progress.emit(int(((processed_count) / total_files) * 100), error_msg)
 
-            else:
-                # No change detected between original and final content
-                content_changed = False
-                if not log_msg: # Only report 'no change' if no other errors occurred
-                    log_msg = f"[No change] {file_name}"
-                else: # Append 'no change' info to existing error/warning messages
-                     log_msg += f"\n[Info] No effective change for {file_name} despite previous warnings."
-
-            # --- 5. Emit Progress ---
-            processed_count += 1
+        if not self._is_running:
+            # Emit final progress for the cancelled run
             percent = int(((processed_count) / total_files) * 100)
-            # Ensure a message is emitted even if log_msg is somehow empty
-            final_log = log_msg or f"[Processed] {file_name} (Status unknown)"
-            self.progress.emit(percent, final_log)
-
+            self.progress.emit(percent, "[Cancelled] Operation stopped before processing remaining files.")
+            print("Replacement thread cancelled.")
 
         # --- End of Loop ---
         print("Replacement thread finished processing loop.")
         self.finished.emit() # Signal completion
-
-    def _read_file(self, file_path: Path) -> tuple[str | None, str | None]:
-        """Reads file content, handles common errors."""
-        content = None
-        error = None
-        try:
-            # Check existence and read permission explicitly first
-            if not file_path.is_file():
-                raise FileNotFoundError(f"File not found: {file_path}")
-            if not os.access(str(file_path), os.R_OK):
-                raise PermissionError("Permission denied reading file")
-
-            # Try reading with UTF-8 first
-            try:
-                content = file_path.read_text(encoding="utf-8")
-            except UnicodeDecodeError:
-                # Log warning and try fallback (system default)
-                print(f"Warning: Non UTF-8 file {file_path.name}. Trying fallback encoding.")
-                try:
-                    content = file_path.read_text(encoding=None) # System default
-                except Exception as fallback_e:
-                    raise UnicodeDecodeError("utf-8", b'', 0, 0, f"Not UTF-8 and fallback failed: {fallback_e}") from fallback_e
-
-        except (FileNotFoundError, PermissionError, UnicodeDecodeError) as e:
-            error = str(e)
-        except Exception as e:
-            error = f"Unexpected read error: {e}"
-            traceback.print_exc() # Log unexpected errors fully
-        return content, error
-
-    def _apply_replacement(self, content: str, pattern: str, replacement: str, use_regex: bool) -> tuple[str, str | None]:
-        """Applies find/replace logic, handles regex errors."""
-        modified_content = content
-        error = None
-        try:
-            if use_regex:
-                # Compile regex for potential efficiency if used many times,
-                # but mainly to catch re.error here.
-                compiled_pattern = re.compile(pattern)
-                modified_content = compiled_pattern.sub(replacement, content)
-            else:
-                # Simple string replacement
-                modified_content = content.replace(pattern, replacement)
-        except re.error as regex_error:
-            error = f"Invalid regex pattern: {regex_error}"
-        except Exception as e:
-            error = f"Unexpected error during replacement: {e}"
-            traceback.print_exc()
-        return modified_content, error
\ No newline at end of file
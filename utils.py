@@ -2,6 +2,8 @@
 
 import sys
 import os
+import locale
+import stat
 import platform
 import subprocess
 import shutil
@@ -83,24 +85,58 @@ def copy_to_clipboard(text: str) -> tuple[bool, str | None]:
 
 
 # --- File I/O Safety ---
-def safe_read_file(file_path: Path) -> tuple[str | None, str | None]:
-    """Reads file content safely, handling potential errors."""
+def probe_path(file_path: Path) -> tuple[os.stat_result | None, str | None]:
+    """
+    Stats a path once, so callers can answer "exists?" / "is it a file?" from a
+    single syscall and pass the result on (e.g. to safe_read_file).
+
+    Returns:
+        A tuple containing:
+        - The os.stat_result, or None if the path can't be stat'ed.
+        - An error message string if it can't, otherwise None.
+    """
+    try:
+        return os.stat(file_path), None
+    except FileNotFoundError:
+        return None, f"File not found: {file_path}"
+    except PermissionError:
+        return None, f"Permission denied accessing: {file_path}"
+    except OSError as e:
+        return None, f"Cannot access {file_path}: {e}"
+
+def safe_read_file(file_path: Path, stat_result: os.stat_result | None = None) -> tuple[str | None, str | None]:
+    """
+    Reads file content safely, handling potential errors.
+
+    If the caller already has the file's stat result (see probe_path), passing it
+    skips the separate is-file and access() checks; an unreadable file then
+    surfaces as the PermissionError raised by the read itself.
+
+    The file is read once as bytes (no text-mode stream layer) and decoded here;
+    line endings are normalized to "\n" like a text-mode read.
+    """
     content = None
     error = None
     try:
-        if not file_path.is_file():
-            raise FileNotFoundError(f"File not found: {file_path}")
-        if not os.access(str(file_path), os.R_OK):
-            raise PermissionError(f"Permission denied reading file: {file_path.name}")
-
+        if stat_result is not None:
+            if not stat.S_ISREG(stat_result.st_mode):
+                raise FileNotFoundError(f"File not found: {file_path}")
+        else:
+            if not file_path.is_file():
+                raise FileNotFoundError(f"File not found: {file_path}")
+            if not os.access(str(file_path), os.R_OK):
+                raise PermissionError(f"Permission denied reading file: {file_path.name}")
+
+        data = file_path.read_bytes()
         try:
-            content = file_path.read_text(encoding="utf-8")
+            content = data.decode("utf-8")
         except UnicodeDecodeError:
             print(f"Warning: Non UTF-8 file {file_path.name}. Trying fallback encoding.")
             try:
-                content = file_path.read_text(encoding=None) # System default
+                content = data.decode(locale.getpreferredencoding(False)) # System default, as open() would use
             except Exception as fallback_e:
                 raise UnicodeDecodeError("utf-8", b'', 0, 0, f"Not UTF-8 and fallback failed: {fallback_e}") from fallback_e
+        if "\r" in content: content = content.replace("\r\n", "\n").replace("\r", "\n")
 
     except (FileNotFoundError, PermissionError, UnicodeDecodeError) as e:
         error = str(e)
@@ -111,6 +147,49 @@ def safe_read_file(file_path: Path) -> tuple[str | None, str | None]:
     return content, error
 
 
+def read_file_head(file_path: Path, max_bytes: int) -> tuple[str | None, str | None]:
+    """
+    Reads at most `max_bytes` from the start of a file, cut back to the last
+    complete line, for display purposes (e.g. previewing very large files).
+    Line endings are normalized like a text-mode read.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            data = f.read(max_bytes)
+        last_newline = data.rfind(b"\n")
+        if last_newline != -1: data = data[:last_newline + 1]
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = data.decode(errors="replace") # Locale-independent best effort, display only
+        if "\r" in text: text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text, None
+    except (FileNotFoundError, PermissionError) as e:
+        return None, str(e)
+    except Exception as e:
+        error = f"Unexpected read error for {file_path.name}: {e}"
+        print(error)
+        return None, error
+
+
+def split_lines(text: str) -> list[str]:
+    """
+    Splits text into lines without line terminators, for diffs and AST line lookups.
+
+    Unlike str.splitlines, only \n, \r\n and \r end a line (the same rule the
+    Python tokenizer uses for ast line numbers), so a form feed or U+2028 inside
+    a line doesn't shift the numbering. str.split('\n') also does less work than
+    splitlines, which checks every character against all its separators.
+    """
+    if not text:
+        return []
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop() # A trailing newline doesn't start another line
+    return lines
+
 def safe_write_file(file_path: Path, content: str) -> tuple[bool, str | None]:
     """Writes content to a file safely, handling potential errors."""
     error = None
@@ -137,6 +216,47 @@ def safe_write_file(file_path: Path, content: str) -> tuple[bool, str | None]:
         traceback.print_exc()
     return success, error
 
+# --- Fast File Copy (Backups / Restores) ---
+def fast_copy(source_path: Path, destination_path: Path, copy_metadata: bool = True):
+    """
+    Copies a file's content and, by default, its metadata (like shutil.copy2).
+
+    On Linux the content is copied with os.copy_file_range, which stays in the
+    kernel and lets filesystems that support it (btrfs, XFS, NFS 4.2, ...) clone
+    or copy server-side instead of moving the bytes. Everywhere else, or if the
+    filesystem refuses, it falls back to shutil.copy2 / shutil.copyfile (which
+    already use sendfile / the platform copy call where available).
+
+    Args:
+        source_path: The file to copy.
+        destination_path: The file to create or overwrite.
+        copy_metadata: If False, only the content is copied and an existing
+                       destination keeps its own permissions and timestamps.
+
+    Raises:
+        OSError: If the copy fails.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            if _copy_with_copy_file_range(source_path, destination_path):
+                if copy_metadata: shutil.copystat(str(source_path), str(destination_path))
+                return
+        except OSError:
+            pass # e.g. EXDEV/EINVAL/ENOSYS on filesystems without support; use the portable path
+    if copy_metadata: shutil.copy2(str(source_path), str(destination_path))
+    else: shutil.copyfile(str(source_path), str(destination_path))
+
+def _copy_with_copy_file_range(source_path: Path, destination_path: Path) -> bool:
+    """Returns False if the kernel stopped early (e.g. file changed size), so the caller can retry."""
+    with open(source_path, "rb") as source, open(destination_path, "wb") as destination:
+        remaining = os.fstat(source.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(source.fileno(), destination.fileno(), remaining)
+            if copied == 0:
+                return False
+            remaining -= copied
+    return True
+
 # --- NEW FUNCTION: Get Central Backup Paths ---
 def get_central_backup_paths(original_file_path: Path) -> tuple[Path | None, Path | None, Path | None, str | None]:
     """
@@ -262,9 +382,9 @@ def backup_and_redo(original_file_path: Path) -> tuple[bool, str | None]:
              raise PermissionError(f"Cannot write to central redo directory: {redo_path.parent}")
 
         # Copy current original file content to the central .redo file
-        # Use copy2 to preserve metadata if desired, though maybe not critical for redo
+        # fast_copy preserves metadata like copy2, though maybe not critical for redo
         print(f"Copying {original_file_path} to central redo {redo_path}")
-        shutil.copy2(str(original_file_path), str(redo_path))
+        fast_copy(original_file_path, redo_path)
 
         return True, None # Success
 
@@ -7,15 +7,69 @@ CodeEditor with line numbers and the DiffDialog.
 """
 
 import difflib
+import hashlib
+from collections import OrderedDict
 from PyQt6.QtWidgets import (
     QPlainTextEdit, QWidget, QTextEdit, QDialog, QVBoxLayout, QHBoxLayout,
     QPushButton, QTextBrowser
 )
 from PyQt6.QtGui import QFont, QPainter, QColor, QTextCharFormat
-from PyQt6.QtCore import Qt, QRect, QSize, pyqtSignal
+from PyQt6.QtCore import Qt, QRect, QSize, QTimer, pyqtSignal, QSortFilterProxyModel, QModelIndex
 # Use direct import for flat structure
 from constants import COLOR_LINE_NUM_BG, COLOR_LINE_NUM_FG, COLOR_HIGHLIGHT_BG
 
+# Editor colours parsed once; the line number area repaints on every scroll and keystroke
+_LINE_NUM_BG_COLOR = QColor(COLOR_LINE_NUM_BG)
+_LINE_NUM_FG_COLOR = QColor(COLOR_LINE_NUM_FG)
+_HIGHLIGHT_BG_COLOR = QColor(COLOR_HIGHLIGHT_BG)
+
+# --- Diff HTML Cache ---
+# Rendered side-by-side diffs keyed by content hashes, so re-opening the same
+# diff (e.g. toggling between "Diff vs Backup" and "Diff vs Redo") skips HtmlDiff.
+_DIFF_HTML_CACHE_MAX = 32
+_diff_html_cache: OrderedDict[tuple[str, str, str, str], str] = OrderedDict()
+
+def _lines_digest(lines: list[str]) -> str:
+    return hashlib.sha256("\n".join(lines).encode("utf-8", "surrogatepass")).hexdigest()
+
+def render_diff_html(original_lines: list[str], new_lines: list[str], fromdesc: str, todesc: str) -> str:
+    """Returns HtmlDiff's side-by-side table for the two line lists, memoized by content."""
+    key = (_lines_digest(original_lines), _lines_digest(new_lines), fromdesc, todesc)
+    html_diff = _diff_html_cache.get(key)
+    if html_diff is not None:
+        _diff_html_cache.move_to_end(key)
+        return html_diff
+    html_diff = difflib.HtmlDiff(wrapcolumn=80, tabsize=4).make_file(
+        original_lines, new_lines, fromdesc=fromdesc, todesc=todesc, context=True, numlines=3
+    )
+    _diff_html_cache[key] = html_diff
+    if len(_diff_html_cache) > _DIFF_HTML_CACHE_MAX:
+        _diff_html_cache.popitem(last=False)
+    return html_diff
+
+# --- File Tree Filter Proxy ---
+class TreeFilterProxyModel(QSortFilterProxyModel):
+    """
+    Filter proxy for the QFileSystemModel tree that never hides the tree's root
+    folder or its ancestors, so the view keeps its root even when nothing (yet)
+    matches the filter.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._root_path = "" # QFileSystemModel-style path ('/' separators)
+
+    def setRootPath(self, root_path: str):
+        self._root_path = root_path.rstrip("/") or root_path
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
+        if self._root_path:
+            path = self.sourceModel().filePath(self.sourceModel().index(source_row, 0, source_parent))
+            stripped_path = path.rstrip("/")
+            if self._root_path == (stripped_path or path) or self._root_path.startswith(stripped_path + "/"):
+                return True
+        return super().filterAcceptsRow(source_row, source_parent)
+
 # --- Line Number Area ---
 class LineNumberArea(QWidget):
     def __init__(self, editor: 'CodeEditor'):
@@ -37,6 +91,14 @@ class CodeEditor(QPlainTextEdit):
         self.setTabStopDistance(self.fontMetrics().horizontalAdvance(' ') * 4)
         self.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
 
+    def setCodeFont(self, font: QFont):
+        """Switches the editor font, keeping tab stops and the line number gutter in sync."""
+        self.setFont(font)
+        self.setTabStopDistance(self.fontMetrics().horizontalAdvance(' ') * 4)
+        self.updateLineNumberAreaWidth()
+        cr = self.contentsRect()
+        self.lineNumberArea.setGeometry(QRect(cr.left(), cr.top(), self.lineNumberAreaWidth(), cr.height()))
+
     def lineNumberAreaWidth(self) -> int:
         digits = len(str(max(1, self.blockCount())))
         return 10 + self.fontMetrics().horizontalAdvance("9") * digits
@@ -57,7 +119,8 @@ class CodeEditor(QPlainTextEdit):
     def lineNumberAreaPaintEvent(self, event):
         """Paints the line numbers within the visible area."""
         painter = QPainter(self.lineNumberArea)
-        painter.fillRect(event.rect(), QColor(COLOR_LINE_NUM_BG))
+        painter.fillRect(event.rect(), _LINE_NUM_BG_COLOR)
+        painter.setPen(_LINE_NUM_FG_COLOR) # Same pen for every number
 
         block = self.firstVisibleBlock()
         blockNumber = block.blockNumber()
@@ -74,7 +137,6 @@ class CodeEditor(QPlainTextEdit):
 
             if block_top <= paint_rect_bottom and block_bottom >= paint_rect_top:
                 number = str(blockNumber + 1)
-                painter.setPen(QColor(COLOR_LINE_NUM_FG))
 
                 # Calculate vertical position - use integer division //
                 paint_y_float = block_top + (block_rect.height() - font_metrics.height()) / 2.0 + font_metrics.ascent()
@@ -107,8 +169,7 @@ class CodeEditor(QPlainTextEdit):
         extraSelections = [];
         if not self.isReadOnly():
             selection = QTextEdit.ExtraSelection()
-            lineColor = QColor(COLOR_HIGHLIGHT_BG)
-            selection.format.setBackground(lineColor)
+            selection.format.setBackground(_HIGHLIGHT_BG_COLOR)
             selection.format.setProperty(QTextCharFormat.Property.FullWidthSelection, True)
             selection.cursor = self.textCursor(); selection.cursor.clearSelection()
             extraSelections.append(selection)
@@ -130,10 +191,22 @@ class DiffDialog(QDialog):
         super().__init__(parent)
         self.setWindowTitle("Side-by-Side Diff Preview"); self.resize(1000, 700)
         layout = QVBoxLayout(self); layout.setContentsMargins(5, 5, 5, 5)
-        html_diff = difflib.HtmlDiff(wrapcolumn=80, tabsize=4).make_file(
-            original_lines, new_lines, fromdesc=fromdesc, todesc=todesc, context=True, numlines=3
-        )
+        # The diff is rendered after the dialog is first shown (see showEvent), so the window opens right away
+        self._diff_args = (original_lines, new_lines, fromdesc, todesc)
         self.diff_browser = QTextBrowser(); self.diff_browser.setOpenExternalLinks(True)
+        self.diff_browser.setPlainText("Computing diff...")
+        layout.addWidget(self.diff_browser)
+        button_box = QHBoxLayout(); close_button = QPushButton("Close"); close_button.setDefault(True)
+        close_button.clicked.connect(self.accept); button_box.addStretch(); button_box.addWidget(close_button)
+        layout.addLayout(button_box)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self._diff_args is not None: QTimer.singleShot(0, self._render_diff)
+
+    def _render_diff(self):
+        if self._diff_args is None: return
+        html_diff = render_diff_html(*self._diff_args); self._diff_args = None
         css = """<style>
             body { background-color: #1e1e1e; color: #d4d4d4; font-family: Consolas, Courier, monospace; }
             table.diff { border-collapse: collapse; width: 100%; font-size: 9pt; }
@@ -146,8 +219,5 @@ class DiffDialog(QDialog):
             a { color: #3794ff; text-decoration: none; } a:hover { text-decoration: underline; }
             td pre { white-space: pre-wrap; word-wrap: break-word; margin: 0; }
         </style>"""
-        self.diff_browser.setHtml(css + html_diff); layout.addWidget(self.diff_browser)
-        button_box = QHBoxLayout(); close_button = QPushButton("Close"); close_button.setDefault(True)
-        close_button.clicked.connect(self.accept); button_box.addStretch(); button_box.addWidget(close_button)
-        layout.addLayout(button_box)
+        self.diff_browser.setHtml(css + html_diff)
 # --- END OF FILE widgets.txt ---
\ No newline at end of file